@@ -224,8 +224,11 @@ async def get_my_benefits(
     all_benefits = get_account_benefits()
     account_type = current_user.account_type.value
     
-    my_benefits = all_benefits.get(account_type, all_benefits["free"])
-    my_benefits["enabled_vocab_features"] = get_enabled_vocab_features(account_type)
+    # Copy nông: dict benefits dùng chung cho cả process, không được sửa trực tiếp
+    my_benefits = {
+        **all_benefits.get(account_type, all_benefits["free"]),
+        "enabled_vocab_features": get_enabled_vocab_features(account_type),
+    }
     
     return {
         "account_type": account_type,
@@ -12,7 +12,7 @@ import uuid
 from app.database.database import get_db
 from app.database.models import User, Payment, AccountType
 from app.auth.security import get_current_active_user
-from app.payment.casso import CassoService, get_pricing_plan, get_all_pricing_plans
+from app.payment.casso import CassoService, transaction_batcher, get_pricing_plan, get_all_pricing_plans
 from app.payment.stripe_payment import StripePayment
 
 router = APIRouter(prefix="/payment", tags=["Payment"])
@@ -112,10 +112,9 @@ async def create_payment(
             currency='VND',
             payment_method='casso',
             transaction_id=payment_id,
-            payment_status='pending',
-            plan_type=payment_request.plan_id,
-            plan_duration_months=plan['months'],
-            metadata={'plan_name': plan['name']}
+            status='pending',
+            subscription_months=plan['months'],
+            payment_data={'plan_id': payment_request.plan_id, 'plan_name': plan['name']}
         )
         
         db.add(payment)
@@ -155,10 +154,9 @@ async def create_payment(
             currency='USD',
             payment_method='stripe',
             transaction_id=payment_id,
-            payment_status='pending',
-            plan_type=payment_request.plan_id,
-            plan_duration_months=plan['months'],
-            metadata={'plan_name': plan['name']}
+            status='pending',
+            subscription_months=plan['months'],
+            payment_data={'plan_id': payment_request.plan_id, 'plan_name': plan['name']}
         )
         
         db.add(payment)
@@ -175,8 +173,8 @@ async def create_payment(
         
         # Update transaction ID with Stripe session ID
         payment.transaction_id = session['session_id']
-        payment.metadata = {
-            **payment.metadata,
+        payment.payment_data = {
+            **(payment.payment_data or {}),
             'stripe_session_id': session['session_id']
         }
         db.commit()
@@ -226,7 +224,7 @@ async def check_payment_status(
         )
     
     # If already completed, return success
-    if payment.payment_status == 'completed':
+    if payment.status == 'completed':
         return {
             "status": "completed",
             "message": "Thanh toán thành công!",
@@ -236,14 +234,11 @@ async def check_payment_status(
     
     # If CASSO payment, check with CASSO API
     if payment.payment_method == 'casso':
-        casso = CassoService()
-        
-        # Get plan to verify amount
-        plan = get_pricing_plan(payment.plan_type)
-        expected_amount = plan['price_vnd']
+        # Số tiền cần khớp = giá VND của gói lúc tạo payment
+        expected_amount = payment.amount
         
-        # Verify transaction
-        transaction = casso.verify_transaction(
+        # Verify transaction (gộp với các request /status đồng thời thành một lần gọi CASSO)
+        transaction = await transaction_batcher.verify(
             order_id=payment_id,
             expected_amount=expected_amount,
             time_window_minutes=30
@@ -251,10 +246,10 @@ async def check_payment_status(
         
         if transaction:
             # Payment found! Upgrade user
-            payment.payment_status = 'completed'
+            payment.status = 'completed'
             payment.transaction_id = transaction['transaction_id']
-            payment.metadata = {
-                **payment.metadata,
+            payment.payment_data = {
+                **(payment.payment_data or {}),
                 'casso_transaction': transaction
             }
             
@@ -262,7 +257,7 @@ async def check_payment_status(
             current_user.account_type = AccountType.PRO
             current_user.daily_note_limit = -1  # Unlimited
             current_user.subscription_start = datetime.utcnow()
-            current_user.subscription_end = datetime.utcnow() + timedelta(days=30 * payment.plan_duration_months)
+            current_user.subscription_end = datetime.utcnow() + timedelta(days=30 * payment.subscription_months)
             
             payment.subscription_start = current_user.subscription_start
             payment.subscription_end = current_user.subscription_end
@@ -301,7 +296,7 @@ async def casso_webhook(
     # Verify signature
     casso = CassoService()
     if x_signature:
-        is_valid = casso.verify_webhook_signature(body_str, x_signature)
+        is_valid = casso.verify_webhook_signature(body, x_signature)
         if not is_valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -312,57 +307,103 @@ async def casso_webhook(
     import json
     webhook_data = json.loads(body_str)
     
-    # Process webhook
-    transaction_info = casso.process_webhook(webhook_data)
-    
-    if not transaction_info['order_id']:
-        return {"status": "ignored", "message": "No order ID found"}
-    
-    # Find payment record
+    # Process webhook (một webhook có thể chứa nhiều transactions)
+    # Transaction không khớp payment nào (ignored/invalid/amount_mismatch) vẫn trả 2xx: gửi lại cũng không khác.
+    # Chỉ lỗi tạm thời (DB) mới trả 503 để CASSO retry cả webhook
+    transactions = casso.process_webhook_batch(webhook_data)
     try:
-        payment = db.query(Payment).filter(
-            Payment.id == uuid.UUID(transaction_info['order_id'])
-        ).first()
-    except:
-        return {"status": "ignored", "message": "Invalid order ID"}
-    
-    if not payment:
-        return {"status": "ignored", "message": "Payment not found"}
+        results = _apply_casso_transactions(db, transactions)
+    except Exception as e:
+        db.rollback()
+        print(f"CASSO webhook processing failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Webhook processing failed, please retry"
+        )
     
-    if payment.payment_status == 'completed':
-        return {"status": "already_processed", "message": "Payment already completed"}
+    if len(results) == 1:
+        return results[0]
+    return {"status": "success", "results": results}
+
+
+def _apply_casso_transactions(db: Session, transactions: list) -> list:
+    """
+    Áp dụng các transactions từ webhook: load payments/users của cả batch bằng hai query IN,
+    cập nhật rồi commit một lần
     
-    # Verify amount
-    plan = get_pricing_plan(payment.plan_type)
-    if transaction_info['amount'] != plan['price_vnd']:
-        return {"status": "amount_mismatch", "message": "Amount does not match"}
+    Returns:
+        Kết quả cho từng transaction (cùng thứ tự)
+    """
+    results = [None] * len(transactions)
+    payment_ids = {}
+    for i, transaction_info in enumerate(transactions):
+        if not transaction_info.get('verified', True):
+            results[i] = {"status": "invalid", "message": "Invalid transaction data"}
+            continue
+        if not transaction_info['order_id']:
+            results[i] = {"status": "ignored", "message": "No order ID found"}
+            continue
+        try:
+            payment_ids[i] = uuid.UUID(transaction_info['order_id'])
+        except ValueError:
+            results[i] = {"status": "ignored", "message": "Invalid order ID"}
     
-    # Update payment status
-    payment.payment_status = 'completed'
-    payment.transaction_id = transaction_info['transaction_id']
-    payment.metadata = {
-        **payment.metadata,
-        'casso_transaction': transaction_info
-    }
+    payments = {}
+    if payment_ids:
+        payments = {
+            payment.id: payment
+            for payment in db.query(Payment).filter(Payment.id.in_(set(payment_ids.values())))
+        }
+    users = {}
+    if payments:
+        user_ids = {payment.user_id for payment in payments.values()}
+        users = {user.id: user for user in db.query(User).filter(User.id.in_(user_ids))}
     
-    # Upgrade user to Pro
-    user = db.query(User).filter(User.id == payment.user_id).first()
-    if user:
-        user.account_type = AccountType.PRO
-        user.daily_note_limit = -1  # Unlimited
-        user.subscription_start = datetime.utcnow()
-        user.subscription_end = datetime.utcnow() + timedelta(days=30 * payment.plan_duration_months)
+    for i, payment_id in payment_ids.items():
+        transaction_info = transactions[i]
+        payment = payments.get(payment_id)
+        if not payment:
+            results[i] = {"status": "ignored", "message": "Payment not found"}
+            continue
         
-        payment.subscription_start = user.subscription_start
-        payment.subscription_end = user.subscription_end
+        if payment.status == 'completed':
+            results[i] = {"status": "already_processed", "message": "Payment already completed"}
+            continue
+        
+        # Verify amount (payment.amount = giá VND của gói lúc tạo payment)
+        if transaction_info['amount'] != payment.amount:
+            results[i] = {"status": "amount_mismatch", "message": "Amount does not match"}
+            continue
+        
+        # Update payment status
+        payment.status = 'completed'
+        payment.transaction_id = transaction_info['transaction_id']
+        payment.payment_data = {
+            **(payment.payment_data or {}),
+            'casso_transaction': transaction_info
+        }
+        
+        # Upgrade user to Pro
+        user = users.get(payment.user_id)
+        if user:
+            user.account_type = AccountType.PRO
+            user.daily_note_limit = -1  # Unlimited
+            user.subscription_start = datetime.utcnow()
+            user.subscription_end = datetime.utcnow() + timedelta(days=30 * payment.subscription_months)
+            
+            payment.subscription_start = user.subscription_start
+            payment.subscription_end = user.subscription_end
+        
+        results[i] = {
+            "status": "success",
+            "message": "Payment processed successfully",
+            "order_id": transaction_info['order_id']
+        }
     
-    db.commit()
+    if any(result["status"] == "success" for result in results):
+        db.commit()
     
-    return {
-        "status": "success",
-        "message": "Payment processed successfully",
-        "order_id": transaction_info['order_id']
-    }
+    return results
 
 
 @router.get("/stripe/success")
@@ -378,7 +419,7 @@ async def stripe_success(session_id: str, db: Session = Depends(get_db)):
         )
     
     # Update payment status
-    payment.payment_status = 'completed'
+    payment.status = 'completed'
     
     # Upgrade user to Pro
     user = db.query(User).filter(User.id == payment.user_id).first()
@@ -386,7 +427,7 @@ async def stripe_success(session_id: str, db: Session = Depends(get_db)):
         user.account_type = AccountType.PRO
         user.daily_note_limit = -1  # Unlimited
         user.subscription_start = datetime.utcnow()
-        user.subscription_end = datetime.utcnow() + timedelta(days=30 * payment.plan_duration_months)
+        user.subscription_end = datetime.utcnow() + timedelta(days=30 * payment.subscription_months)
         
         payment.subscription_start = user.subscription_start
         payment.subscription_end = user.subscription_end
@@ -12,7 +12,7 @@ import os
 from app.database.database import get_db
 from app.database.models import User
 from app.auth.security import get_current_active_user
-from app.auth.rate_limiter import check_daily_note_limit, increment_note_count
+from app.auth.rate_limiter import check_daily_note_limit, daily_limit_exceeded, increment_note_count
 
 
 async def get_optional_user(
@@ -76,19 +76,22 @@ async def increment_user_note_count(
     db: Session
 ) -> None:
     """
-    Increment user's note count after successful processing
+    Increment user's daily note count (không tự commit: caller commit một lần cùng với note,
+    giống increment_note_count). Lỗi DB được raise lên, không cho request đi tiếp.
+    Chưa endpoint v1 nào gọi helper này.
     
     Args:
         user: User object (can be None for backward compatibility)
         db: Database session
+    
+    Raises:
+        HTTPException: 429 nếu user đã hết số note trong ngày (counter không đổi)
     """
     if not user:
         return
     
-    try:
-        increment_note_count(db, user)
-    except Exception as e:
-        print(f"Error incrementing note count: {e}")
+    if not increment_note_count(db, user):
+        raise daily_limit_exceeded(user)
 
 
 def get_ai_model_for_user(user: Optional[User]) -> str:
@@ -1,37 +1,72 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query, Request, Response, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Optional, List, Tuple, Callable, Union, Iterator
+import asyncio
 import uuid
 import os
-import hashlib
+import re
+import shutil
+import tempfile
+import time
+import functools
+import itertools
 import json
+import logging
+import hashlib
+import orjson
 from datetime import datetime
 
 from app.agents.orchestrator import process_text, process_file, process_combined_inputs
 from app.services.job_service import job_service
 from app.services.db_service import db_service
 from app.services.feedback_service import feedback_service
-from app.database.database import get_db
-from app.database.models import User
+from app.services.cache_service import cache_service
+from app.services.coalesce_service import request_coalescer
+from app.database.database import get_db, SessionLocal
+from app.database.models import User, Feedback
+from app.core.detector import detect_input_type
 from app.agents.summarizer_agent import translate_text_via_llm
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 AI_RESULT_SCHEMA_VERSION = 4
+CACHED_RESULT_CACHE_CONTROL = "private, max-age=60"
+
+_VOCAB_HASH_PREFIX = b"vocab::"
+_TEXT_HASH_PREFIX = b"text::"
+_CHECKED_HASH_SEP = b"|CHECKED:"
+# Bản copy upload cho task AI: giữ trong RAM tới ngưỡng này rồi mới ghi ra đĩa
+_UPLOAD_SPOOL_MAX_SIZE = 1024 * 1024
 
 
 def _stable_checked_vocab_items(checked_vocab_items: Optional[str]) -> str:
     """
     Normalize checked_vocab_items to a stable string for hashing/caching.
     Accepts JSON array string or any raw string fallback.
+    Empty input returns before touching the memo cache.
     """
     if not checked_vocab_items:
         return ""
     s = checked_vocab_items.strip()
     if not s:
         return ""
+    return _normalize_checked_vocab_items(s)
+
+
+@functools.lru_cache(maxsize=1024)
+def _normalize_checked_vocab_items(s: str) -> str:
+    """
+    Memoized core of _stable_checked_vocab_items (input already stripped, non-empty):
+    the same checklist is resent on every request/retry for a note, so the
+    parse + dedupe + sort runs once per distinct checklist.
+    """
     try:
-        parsed = json.loads(s)
+        parsed = _loads_like_stdlib_json(s)
         if isinstance(parsed, list):
             dedup = {}
             for x in parsed:
@@ -45,12 +80,32 @@ def _stable_checked_vocab_items(checked_vocab_items: Optional[str]) -> str:
                     dedup[key] = item
             normalized = list(dedup.values())
             normalized.sort(key=lambda v: v.lower())
-            return json.dumps(normalized, ensure_ascii=False)
+            try:
+                # Same bytes as json.dumps(normalized, ensure_ascii=False) so stored hashes stay valid
+                return "[" + ", ".join(orjson.dumps(v).decode('utf-8') for v in normalized) + "]"
+            except orjson.JSONEncodeError:
+                # Lone surrogates: orjson refuses them, the stdlib writes them through
+                return json.dumps(normalized, ensure_ascii=False)
     except Exception:
         pass
     return s
 
 
+def _loads_like_stdlib_json(s: str):
+    """
+    orjson.loads, falling back to json.loads wherever the two disagree:
+    NaN/Infinity/out-of-range floats (orjson rejects) and integers beyond 64 bits
+    (orjson silently turns them into floats, possibly nested in an item)
+    """
+    try:
+        parsed = orjson.loads(s)
+    except orjson.JSONDecodeError:
+        return json.loads(s)
+    if isinstance(parsed, list) and any(isinstance(x, (float, dict, list)) for x in parsed):
+        return json.loads(s)
+    return parsed
+
+
 def _apply_reset_ids_for_cloze_and_match_pairs(result: dict, content_hash: str) -> None:
     """
     Ensure Cloze Test and Match Pairs are treated as a 'new set' when note content changes.
@@ -65,23 +120,99 @@ def _apply_reset_ids_for_cloze_and_match_pairs(result: dict, content_hash: str)
     except Exception:
         base = 0
     set_id = base
+    # enumerate bắt đầu thẳng từ id đầu tiên -> mỗi item chỉ còn 2 phép gán dict
+    id_base = set_id * 1000
 
     cloze_tests = result.get("cloze_tests")
     if isinstance(cloze_tests, list):
-        for idx, item in enumerate(cloze_tests, start=1):
+        for item_id, item in enumerate(cloze_tests, start=id_base + 1):
             if isinstance(item, dict):
-                item["id"] = set_id * 1000 + idx
+                item["id"] = item_id
                 item["set_id"] = set_id
 
     match_pairs = result.get("match_pairs")
     if isinstance(match_pairs, list):
         offset = 500
-        for idx, item in enumerate(match_pairs, start=1):
+        for item_id, item in enumerate(match_pairs, start=id_base + offset + 1):
             if isinstance(item, dict):
-                item["id"] = set_id * 1000 + offset + idx
+                item["id"] = item_id
                 item["set_id"] = set_id
 
 
+def _file_digest(fileobj) -> str:
+    """
+    blake2b (8 bytes) của toàn bộ file, dùng vòng đọc C của hashlib.file_digest (Python 3.11+)
+    """
+    fileobj.seek(0)
+    digest = hashlib.file_digest(fileobj, lambda: hashlib.blake2b(digest_size=8)).hexdigest()
+    fileobj.seek(0)
+    return digest
+
+
+def _copy_upload(f: UploadFile) -> UploadFile:
+    """
+    Bản copy của file upload thuộc riêng task AI được coalesce: request tạo ra task
+    có thể kết thúc (client ngắt kết nối) và đóng upload gốc trong khi task vẫn chạy
+    """
+    f.file.seek(0)
+    spooled = tempfile.SpooledTemporaryFile(max_size=_UPLOAD_SPOOL_MAX_SIZE)
+    shutil.copyfileobj(f.file, spooled)
+    spooled.seek(0)
+    f.file.seek(0)
+    return UploadFile(spooled, size=f.size, filename=f.filename, headers=f.headers)
+
+
+async def _process_file_in_task(upload: UploadFile, **kwargs):
+    """
+    process_file với session và file riêng của task (không dùng tài nguyên của request nào)
+    """
+    db = SessionLocal()
+    try:
+        return await process_file(upload, db=db, use_rag=True, **kwargs)
+    finally:
+        db.close()
+        upload.file.close()
+
+
+async def _process_text_in_task(text: str, **kwargs):
+    """
+    process_text với session riêng của task (session của request có thể đã đóng)
+    """
+    db = SessionLocal()
+    try:
+        return await process_text(text, db=db, use_rag=True, **kwargs)
+    finally:
+        db.close()
+
+
+async def _digest_upload(f: UploadFile) -> Optional[str]:
+    """
+    Hash toàn bộ nội dung file upload (RAM không phụ thuộc kích thước file) trong threadpool,
+    file được seek(0) lại để pipeline đọc. Trả về None nếu không đọc được file.
+    """
+    try:
+        return await run_in_threadpool(_file_digest, f.file)
+    except (OSError, ValueError):
+        return None
+
+
+def _dedupe_uploads(
+    uploads: List[UploadFile],
+    digests: List[Optional[str]]
+) -> Tuple[List[UploadFile], List[Optional[str]]]:
+    """
+    Loại bỏ các file trùng nội dung (ví dụ cùng một screenshot gửi 2 lần),
+    giữ lại file xuất hiện đầu tiên và thứ tự ban đầu.
+    """
+    unique = {}
+    for f, digest in zip(uploads, digests):
+        # Không đọc được file -> giữ nguyên, để pipeline tự báo lỗi
+        key = digest if digest is not None else id(f)
+        unique.setdefault(key, (f, digest))
+    kept = list(unique.values())
+    return [f for f, _ in kept], [d for _, d in kept]
+
+
 @router.post("/translate")
 async def translate_text_api(
     text: str = Form(..., description="Text cần dịch"),
@@ -108,10 +239,270 @@ def get_user_uuid(db: Session, user_id: str) -> uuid.UUID:
     try:
         return uuid.UUID(user_id)
     except ValueError:
-        user = db.query(User).filter(User.username == user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail=f"User '{user_id}' not found")
-        return user.id
+        pass
+    
+    # Username -> UUID không đổi: dùng chung user cache với _get_cached_user
+    cached = cache_service.get_user(user_id)
+    if cached is not None:
+        return uuid.UUID(cached)
+    
+    # Chỉ select cột cần thiết, không hydrate cả User object
+    user_uuid = db.execute(
+        select(User.id).where(User.username == user_id)
+    ).scalar_one_or_none()
+    if user_uuid is None:
+        raise HTTPException(status_code=404, detail=f"User '{user_id}' not found")
+    cache_service.set_user(user_id, str(user_uuid))
+    return user_uuid
+
+
+def _get_cached_user(db: Session, username: str) -> Tuple[str, str]:
+    """
+    Lấy (user UUID string, account_type) theo username. UUID lấy từ in-process cache;
+    account_type luôn đọc từ DB (một lookup theo primary key) vì có thể vừa đổi ở worker khác
+    """
+    cached = cache_service.get_user(username)
+    if cached is not None:
+        account_type = db_service.get_user_account_type(db, cached)
+        if account_type is not None:
+            return cached, account_type
+    
+    user = db_service.get_or_create_user(db, username=username)
+    account_type = user.account_type.value if hasattr(user.account_type, 'value') else str(user.account_type)
+    cache_service.set_user(username, str(user.id))
+    return str(user.id), account_type
+
+
+def _save_note_for_user(db: Session, username: str, note_id: str, **note_fields):
+    """
+    Lưu note (upsert) cho username trong một transaction duy nhất: user mới (nếu chưa có)
+    và note được flush rồi commit một lần, lỗi thì rollback cả hai. Trả về note đã lưu
+    (refresh để có updated_at do DB sinh)
+    """
+    try:
+        cached = cache_service.get_user(username)
+        if cached is not None:
+            user_uuid = cached
+        else:
+            user_uuid = str(db_service.get_or_create_user(db, username=username, commit=False).id)
+        note = db_service.create_note(db, user_id=user_uuid, note_id=note_id, commit=False, **note_fields)
+        db.commit()
+        db.refresh(note)
+        return note
+    except Exception:
+        db.rollback()
+        raise
+
+
+_CACHED_REVIEW_KEYS = (
+    'vocab_story', 'vocab_mcqs', 'flashcards', 'mindmap',
+    'summary_table', 'cloze_tests', 'match_pairs'
+)
+
+# Nghĩa placeholder do LLM sinh ra (gộp thành một regex, match trong C)
+_PLACEHOLDER_MEANING_RE = re.compile("|".join(re.escape(p) for p in (
+    "nghĩa của", "nghĩa ngắn gọn", "ý nghĩa ngắn gọn",
+    "thực tế của", "meaning of", "nghĩa của từ"
+)))
+
+
+def _build_cached_response(existing_note) -> dict:
+    """
+    Dựng response từ note đã lưu (cùng shape với kết quả AI)
+    """
+    result = {
+        'summary': existing_note.summary,
+        'summaries': existing_note.summaries,
+        'review': existing_note.review or {},
+        'questions': existing_note.questions or [],
+        'mcqs': existing_note.mcqs or {},
+        'raw_text': existing_note.raw_text,
+        'processed_text': existing_note.processed_text,
+    }
+    
+    review_data = existing_note.review
+    if review_data and isinstance(review_data, dict):
+        result.update({key: review_data.get(key) for key in _CACHED_REVIEW_KEYS})
+        if 'sources' in review_data:
+            result['sources'] = review_data['sources']
+    return result
+
+
+def _validate_cached_vocab_results(result: dict) -> bool:
+    """
+    Kiểm tra vocab_story / cloze_tests / match_pairs đã cache còn dùng được không.
+    Lọc bỏ item lỗi ngay trong result; trả về False nếu phải chạy AI lại.
+    """
+    vocab_story = result.get('vocab_story')
+    cloze_tests = result.get('cloze_tests')
+    match_pairs = result.get('match_pairs')
+    
+    if vocab_story:
+        story_paras = vocab_story.get('paragraphs', [])
+        if not isinstance(story_paras, list) or len(story_paras) < 1:
+            logger.debug("cached vocab_story invalid (%d paragraphs, required: 1+), will regenerate", len(story_paras) if isinstance(story_paras, list) else 0)
+            vocab_story = None
+    
+    if cloze_tests:
+        valid_cloze = [
+            item for item in cloze_tests
+            if isinstance(item, dict)
+            and isinstance(item.get('blanks', []), list)
+            and len(item.get('blanks', [])) == 1
+        ]
+        if valid_cloze:
+            cloze_tests = valid_cloze
+        else:
+            logger.debug("cached cloze_tests invalid, will regenerate")
+            cloze_tests = None
+    
+    if match_pairs:
+        valid_pairs = []
+        for item in match_pairs:
+            if isinstance(item, dict):
+                meaning = item.get('meaning', '')
+                meaning_lower = str(meaning).lower()
+                if not _PLACEHOLDER_MEANING_RE.search(meaning_lower) and meaning.strip():
+                    valid_pairs.append(item)
+        if valid_pairs:
+            match_pairs = valid_pairs
+        else:
+            logger.debug("cached match_pairs invalid, will regenerate")
+            match_pairs = None
+    
+    if not vocab_story or not cloze_tests or not match_pairs:
+        logger.debug("some cached results invalid, will regenerate")
+        return False
+    
+    result['vocab_story'] = vocab_story
+    result['cloze_tests'] = cloze_tests
+    result['match_pairs'] = match_pairs
+    return True
+
+
+def _serialize_result(result: dict) -> bytes:
+    """
+    Serialize kết quả AI một lần thành JSON bytes để cache và trả thẳng ra response
+    """
+    return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _cache_note_body(note, result: dict, content_hash: str) -> bytes:
+    """
+    Serialize response của note đã lưu (result dựng bằng _build_cached_response) và cache theo
+    (id, updated_at). Dùng chung cho lần đọc từ DB và ngay sau khi lưu kết quả AI mới,
+    để cache hit luôn trả cùng một shape
+    """
+    _apply_reset_ids_for_cloze_and_match_pairs(result, content_hash)
+    body = _serialize_result(result)
+    cache_service.set_note_body(str(note.id), note.updated_at, body)
+    return body
+
+
+def _json_response(body: Union[str, bytes]) -> Response:
+    """
+    Trả body JSON đã dựng sẵn (từ json_agg của Postgres / to_json()) nguyên văn, không qua jsonable_encoder
+    """
+    return Response(content=body, media_type="application/json")
+
+
+def _note_etag(content_hash: Optional[str], updated_at: Optional[datetime]) -> Optional[str]:
+    """
+    ETag của note đã lưu: content_hash + schema AI + updated_at (note được ghi lại với cùng
+    nội dung, hoặc server đổi schema kết quả, vẫn đổi ETag). Note chưa có content_hash -> không có ETag.
+    """
+    if not content_hash:
+        return None
+    if updated_at is None:
+        return f'"{content_hash}-v{AI_RESULT_SCHEMA_VERSION}"'
+    return f'"{content_hash}-v{AI_RESULT_SCHEMA_VERSION}-{int(updated_at.timestamp() * 1000)}"'
+
+
+def _if_none_match(header: Optional[str], etag: Optional[str]) -> bool:
+    """
+    If-None-Match có khớp etag không: hỗ trợ "*", danh sách cách nhau bởi dấu phẩy
+    và validator yếu (W/"..."), so sánh kiểu weak như RFC 9110 yêu cầu
+    """
+    if not header or not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _respond_cached(content_hash: str, updated_at: Optional[datetime], body: bytes) -> Response:
+    """
+    Trả body JSON đã serialize sẵn (bỏ qua jsonable_encoder) kèm ETag giống GET /notes/{note_id}.
+    Endpoint POST không trả 304 (RFC 9110 chỉ cho GET/HEAD) nên If-None-Match bị bỏ qua;
+    client dùng ETag này cho GET /notes/{note_id}
+    """
+    headers = {"Cache-Control": CACHED_RESULT_CACHE_CONTROL}
+    etag = _note_etag(content_hash, updated_at)
+    if etag:
+        headers["ETag"] = etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _try_serve_cached(
+    db: Session,
+    user_id: str,
+    note_id: str,
+    content_hash: str,
+    validator: Optional[Callable[[dict], bool]] = None
+) -> Optional[Tuple[bytes, Optional[datetime]]]:
+    """
+    Trả về kết quả đã lưu (JSON bytes, updated_at của note) nếu nội dung và schema AI không đổi,
+    ngược lại None (chạy AI)
+    
+    Args:
+        db: Database session
+        user_id: Username từ app
+        note_id: Custom note ID từ app
+        content_hash: Hash nội dung của request hiện tại
+        validator: Kiểm tra thêm kết quả đã lưu (False -> chạy AI lại)
+        
+    Returns:
+        (Response body (JSON bytes), updated_at) hoặc None
+    """
+    try:
+        user_uuid, _ = _get_cached_user(db, user_id)
+        # content_hash + schema version được so khớp ngay trong SQL, chỉ lấy (id, updated_at)
+        version = db_service.get_note_fresh_version(
+            db, user_uuid, note_id, content_hash, AI_RESULT_SCHEMA_VERSION
+        )
+        if version is None:
+            logger.debug("note %s not cached or content changed, running AI", note_id)
+            return None
+        
+        note_pk, updated_at = version
+        cached_body = cache_service.get_note_body(str(note_pk), updated_at)
+        if cached_body is not None:
+            logger.debug("note %s served from memory cache", note_id)
+            return cached_body, updated_at
+        
+        existing_note = db_service.get_note_if_fresh(
+            db, user_uuid, note_id, content_hash, AI_RESULT_SCHEMA_VERSION
+        )
+        if not existing_note:
+            return None
+        
+        result = _build_cached_response(existing_note)
+        if validator is not None and not validator(result):
+            logger.debug("note %s cached result failed validation, running AI again", note_id)
+            return None
+        
+        logger.debug("note %s served from DB cache", note_id)
+        return _cache_note_body(existing_note, result, content_hash), existing_note.updated_at
+    except Exception:
+        logger.warning("cache check failed for note %s", note_id, exc_info=True)
+        return None
 
 @router.post("/summarize")
 async def summarize_text_sync(
@@ -133,11 +524,12 @@ async def summarize_text_sync(
     
     if user_id and note_id:
         try:
-            user = db_service.get_or_create_user(db, username=user_id)
+            user_uuid, _ = await run_in_threadpool(_get_cached_user, db, user_id)
             
-            db_service.create_note(
+            await run_in_threadpool(
+                db_service.create_note,
                 db=db,
-                user_id=str(user.id),
+                user_id=user_uuid,
                 note_id=note_id,
                 file_type='text',
                 raw_text=result.get('raw_text'),
@@ -148,19 +540,22 @@ async def summarize_text_sync(
                 mcqs=result.get('mcqs'),
                 review=result.get('review')
             )
-        except Exception as e:
-            print(f"Error saving to database: {e}")
+        except Exception:
+            logger.exception("db persistence failed for note %s", note_id)
     
     return result
 
 @router.post("/process")
 async def process_input_sync(
+    response: Response,
     file: UploadFile = File(None),
     text: str = Form(None),
     user_id: Optional[str] = Form(None),
     note_id: Optional[str] = Form(None),
     content_type: Optional[str] = Form(None),
     checked_vocab_items: Optional[str] = Form(None),
+    async_mode: bool = Form(False),
+    x_content_hash: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """
@@ -171,102 +566,70 @@ async def process_input_sync(
     Optional params:
     - user_id: User ID để lưu vào database
     - note_id: Custom note ID từ app
+    - async_mode: True -> đẩy vào background worker (Celery), trả về job_id ngay.
+      Dùng GET /process/status/{note_id} hoặc GET /jobs/{job_id}/status để theo dõi
+    - X-Content-Hash header (text input): hash app đã tính (sha256 "text::"/"vocab::"),
+      dùng để check cache mà không cần hash lại; khi lưu server vẫn tự tính hash
     """
+    if async_mode:
+        if file:
+            return await job_service.create_file_processing_job(file, user_id, note_id, db)
+        if text:
+            return await job_service.create_text_processing_job(text, user_id, note_id, db)
+        raise HTTPException(status_code=400, detail="Cần cung cấp file hoặc text")
+    
     # ⭐ Get user's account type for AI model selection
     account_type = "free"  # Default
     if user_id:
         try:
-            user = db_service.get_or_create_user(db, username=user_id)
-            account_type = user.account_type.value if hasattr(user.account_type, 'value') else str(user.account_type)
-            print(f"[router] User {user_id} account_type: {account_type}")
-        except Exception as e:
-            print(f"[router] Error getting user account type: {e}, using default 'free'")
+            _, account_type = await run_in_threadpool(_get_cached_user, db, user_id)
+            logger.debug("user %s account_type: %s", user_id, account_type)
+        except Exception:
+            logger.warning("could not resolve account type for user %s, using 'free'", user_id, exc_info=True)
     
     if file:
-        file_content = await file.read()
-        await file.seek(0)  
-        file_size = len(file_content)
-        file_hash = hashlib.sha256(file_content).hexdigest()[:16]  
+        # Hash theo từng chunk (không đọc cả file vào RAM) trong threadpool để không chặn event loop.
+        # blake2b nhanh hơn sha256 và chỉ dùng làm cache key (không cần tương thích frontend)
+        file_hash = await run_in_threadpool(_file_digest, file.file)
+        file_size = file.size
+        stable_checked = _stable_checked_vocab_items(checked_vocab_items)
+        content_hash = hashlib.blake2b(
+            f"FILE:{file.filename}:{file_hash}|MODE:{content_type or ''}|CHECKED:{stable_checked}".encode('utf-8'),
+            digest_size=32
+        ).hexdigest()
         
         if user_id and note_id:
-            try:
-                user = db_service.get_or_create_user(db, username=user_id)
-                existing_note = db_service.get_note_by_user_and_note_id(db, str(user.id), note_id)
-                
-                if existing_note:
-                    stable_checked = _stable_checked_vocab_items(checked_vocab_items)
-                    current_content_hash = hashlib.sha256(
-                        f"FILE:{file.filename}:{file_hash}|MODE:{content_type or ''}|CHECKED:{stable_checked}".encode('utf-8')
-                    ).hexdigest()
-                    
-                    saved_review = existing_note.review or {}
-                    saved_content_hash = saved_review.get('content_hash') if isinstance(saved_review, dict) else None
-                    saved_schema_version = saved_review.get('ai_schema_version') if isinstance(saved_review, dict) else None
-                    
-                    if not saved_content_hash:
-                        saved_content = existing_note.raw_text or ""
-                        saved_content_hash = hashlib.sha256(
-                            saved_content.encode('utf-8')
-                        ).hexdigest()
-                    
-                    if (
-                        current_content_hash == saved_content_hash
-                        and existing_note.processed_text
-                        and saved_schema_version == AI_RESULT_SCHEMA_VERSION
-                    ):
-                        print(f"[cache] Note {note_id} found in DB, file unchanged, returning cached result")
-                        result = {
-                            'summary': existing_note.summary,
-                            'summaries': existing_note.summaries,
-                            'review': existing_note.review or {},
-                            'questions': existing_note.questions or [],
-                            'mcqs': existing_note.mcqs or {},
-                            'raw_text': existing_note.raw_text,
-                            'processed_text': existing_note.processed_text,
-                        }
-                        
-                        if existing_note.review:
-                            review_data = existing_note.review
-                            if isinstance(review_data, dict):
-                                result['vocab_story'] = review_data.get('vocab_story')
-                                result['vocab_mcqs'] = review_data.get('vocab_mcqs')
-                                result['flashcards'] = review_data.get('flashcards')
-                                result['mindmap'] = review_data.get('mindmap')
-                                result['summary_table'] = review_data.get('summary_table')
-                                result['cloze_tests'] = review_data.get('cloze_tests')
-                                result['match_pairs'] = review_data.get('match_pairs')
-                                if 'sources' in review_data:
-                                    result['sources'] = review_data['sources']
-                        
-                        _apply_reset_ids_for_cloze_and_match_pairs(result, current_content_hash)
-                        return result
-                    else:
-                        print(f"[cache] Note {note_id} found but file changed, running AI again")
-            except Exception as e:
-                print(f"Error checking cache: {e}")
+            cached = await run_in_threadpool(_try_serve_cached, db, user_id, note_id, content_hash)
+            if cached is not None:
+                return _respond_cached(content_hash, *cached)
         
-        result = await process_file(
-            file,
-            db=db,
-            use_rag=True,
-            content_type=content_type,
-            checked_vocab_items=checked_vocab_items,
-            account_type=account_type,  # ⭐ Pass account_type
-        )
+        # Upload giống hệt đang được xử lý ở request khác -> chờ chung một lần chạy AI.
+        # Task AI nhận bản copy của file (đóng khi task xong); request không khởi chạy task thì tự đóng
+        upload_copy = await run_in_threadpool(_copy_upload, file)
+        task_started = False
+        
+        def start_task():
+            nonlocal task_started
+            task_started = True
+            return _process_file_in_task(
+                upload_copy,
+                content_type=content_type,
+                checked_vocab_items=checked_vocab_items,
+                account_type=account_type,  # ⭐ Pass account_type
+            )
+        
+        try:
+            result = await request_coalescer.run(("file", content_hash, account_type), start_task)
+        finally:
+            if not task_started:
+                upload_copy.file.close()
         
         if user_id and note_id:
             try:
-                user = db_service.get_or_create_user(db, username=user_id)
+                user_uuid, _ = await run_in_threadpool(_get_cached_user, db, user_id)
                 
-                from app.core.detector import detect_input_type
-                import tempfile
-                import os
-                suffix = os.path.splitext(file.filename)[1]
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-                tmp.write(file_content)
-                tmp.close()
-                file_type = detect_input_type(tmp.name)
-                os.remove(tmp.name)
+                # detect_input_type chỉ dựa vào extension/mimetype -> không cần ghi file tạm
+                file_type = detect_input_type(file.filename or "")
                 
                 review_payload = result.get('review') or {}
                 if result.get('sources'):
@@ -282,18 +645,15 @@ async def process_input_sync(
                     review_payload['cloze_tests'] = result.get('cloze_tests')
                     review_payload['match_pairs'] = result.get('match_pairs')
                 
-                stable_checked = _stable_checked_vocab_items(checked_vocab_items)
-                content_hash = hashlib.sha256(
-                    f"FILE:{file.filename}:{file_hash}|MODE:{content_type or ''}|CHECKED:{stable_checked}".encode('utf-8')
-                ).hexdigest()
                 review_payload['content_hash'] = content_hash
                 review_payload['ai_schema_version'] = AI_RESULT_SCHEMA_VERSION
 
                 _apply_reset_ids_for_cloze_and_match_pairs(result, content_hash)
                 
-                db_service.create_note(
+                saved_note = await run_in_threadpool(
+                    db_service.create_note,
                     db=db,
-                    user_id=str(user.id),
+                    user_id=user_uuid,
                     note_id=note_id,
                     file_type=file_type,
                     filename=file.filename,
@@ -306,81 +666,46 @@ async def process_input_sync(
                     mcqs=result.get('mcqs'),
                     review=review_payload
                 )
-            except Exception as e:
-                print(f"Error saving to database: {e}")
+                _cache_note_body(saved_note, _build_cached_response(saved_note), content_hash)
+                response.headers["ETag"] = _note_etag(content_hash, saved_note.updated_at)
+            except Exception:
+                logger.exception("db persistence failed for note %s", note_id)
                 
     elif text:
-        if user_id and note_id:
-            try:
-                user = db_service.get_or_create_user(db, username=user_id)
-                existing_note = db_service.get_note_by_user_and_note_id(db, str(user.id), note_id)
-                
-                if existing_note:
-                    hash_prefix = "vocab::" if content_type == "checklist" else "text::"
-                    stable_checked = _stable_checked_vocab_items(checked_vocab_items)
-                    current_content_hash = hashlib.sha256(
-                        f"{hash_prefix}{text.strip()}|CHECKED:{stable_checked}".encode('utf-8')
-                    ).hexdigest()
-                    
-                    saved_review = existing_note.review or {}
-                    saved_content_hash = saved_review.get('content_hash') if isinstance(saved_review, dict) else None
-                    saved_schema_version = saved_review.get('ai_schema_version') if isinstance(saved_review, dict) else None
-                    
-                    if not saved_content_hash:
-                        saved_content = existing_note.raw_text or ""
-                        saved_hash_prefix = "vocab::" if (content_type == "checklist" or existing_note.file_type == "checklist") else "text::"
-                        saved_content_hash = hashlib.sha256(
-                            f"{saved_hash_prefix}{saved_content}".encode('utf-8')
-                        ).hexdigest()
-                    
-                    if (
-                        current_content_hash == saved_content_hash
-                        and existing_note.processed_text
-                        and saved_schema_version == AI_RESULT_SCHEMA_VERSION
-                    ):
-                        print(f"[cache] Note {note_id} found in DB, content unchanged, returning cached result")
-                        result = {
-                            'summary': existing_note.summary,
-                            'summaries': existing_note.summaries,
-                            'review': existing_note.review or {},
-                            'questions': existing_note.questions or [],
-                            'mcqs': existing_note.mcqs or {},
-                            'raw_text': existing_note.raw_text,
-                            'processed_text': existing_note.processed_text,
-                        }
-                        
-                        if existing_note.review:
-                            review_data = existing_note.review
-                            if isinstance(review_data, dict):
-                                result['vocab_story'] = review_data.get('vocab_story')
-                                result['vocab_mcqs'] = review_data.get('vocab_mcqs')
-                                result['flashcards'] = review_data.get('flashcards')
-                                result['mindmap'] = review_data.get('mindmap')
-                                result['summary_table'] = review_data.get('summary_table')
-                                result['cloze_tests'] = review_data.get('cloze_tests')
-                                result['match_pairs'] = review_data.get('match_pairs')
-                                if 'sources' in review_data:
-                                    result['sources'] = review_data['sources']
-                        
-                        _apply_reset_ids_for_cloze_and_match_pairs(result, current_content_hash)
-                        return result
-                    else:
-                        print(f"[cache] Note {note_id} found but content changed, running AI again")
-            except Exception as e:
-                print(f"Error checking cache: {e}")
+        client_hash = x_content_hash.strip().lower() if x_content_hash else None
+        if user_id and note_id and client_hash:
+            # Hash của client chỉ dùng để đọc cache (so khớp với hash server đã lưu)
+            cached = await run_in_threadpool(_try_serve_cached, db, user_id, note_id, client_hash)
+            if cached is not None:
+                return _respond_cached(client_hash, *cached)
         
-        result = await process_text(
-            text,
-            db=db,
-            use_rag=True,
-            content_type=content_type,
-            checked_vocab_items=checked_vocab_items,
-            account_type=account_type,  # ⭐ Pass account_type
+        stable_checked = _stable_checked_vocab_items(checked_vocab_items)
+        # Feed hasher từng phần (bytes prefix dựng sẵn) thay vì ghép một chuỗi lớn rồi encode.
+        # Kết quả giống hệt sha256(f"{prefix}{text}|CHECKED:{checked}") -> tương thích frontend
+        hasher = hashlib.sha256(_VOCAB_HASH_PREFIX if content_type == "checklist" else _TEXT_HASH_PREFIX)
+        hasher.update(text.strip().encode('utf-8'))
+        hasher.update(_CHECKED_HASH_SEP)
+        hasher.update(stable_checked.encode('utf-8'))
+        content_hash = hasher.hexdigest()
+        
+        if user_id and note_id and content_hash != client_hash:
+            cached = await run_in_threadpool(_try_serve_cached, db, user_id, note_id, content_hash)
+            if cached is not None:
+                return _respond_cached(content_hash, *cached)
+        
+        result = await request_coalescer.run(
+            ("text", content_hash, content_type, account_type),
+            lambda: _process_text_in_task(
+                text,
+                content_type=content_type,
+                checked_vocab_items=checked_vocab_items,
+                account_type=account_type,  # ⭐ Pass account_type
+            )
         )
         
         if user_id and note_id:
             try:
-                user = db_service.get_or_create_user(db, username=user_id)
+                user_uuid, _ = await run_in_threadpool(_get_cached_user, db, user_id)
                 
                 review_payload = result.get('review') or {}
                 if result.get('sources'):
@@ -398,19 +723,15 @@ async def process_input_sync(
                     review_payload['cloze_tests'] = result.get('cloze_tests')
                     review_payload['match_pairs'] = result.get('match_pairs')
                 
-                hash_prefix = "vocab::" if content_type == "checklist" else "text::"
-                stable_checked = _stable_checked_vocab_items(checked_vocab_items)
-                content_hash = hashlib.sha256(
-                    f"{hash_prefix}{text.strip()}|CHECKED:{stable_checked}".encode('utf-8')
-                ).hexdigest()
                 review_payload['content_hash'] = content_hash
                 review_payload['ai_schema_version'] = AI_RESULT_SCHEMA_VERSION
 
                 _apply_reset_ids_for_cloze_and_match_pairs(result, content_hash)
                 
-                db_service.create_note(
+                saved_note = await run_in_threadpool(
+                    db_service.create_note,
                     db=db,
-                    user_id=str(user.id),
+                    user_id=user_uuid,
                     note_id=note_id,
                     file_type='text',
                     raw_text=result.get('raw_text'),
@@ -421,8 +742,10 @@ async def process_input_sync(
                     mcqs=result.get('mcqs'),
                     review=review_payload
                 )
-            except Exception as e:
-                print(f"Error saving to database: {e}")
+                _cache_note_body(saved_note, _build_cached_response(saved_note), content_hash)
+                response.headers["ETag"] = _note_etag(content_hash, saved_note.updated_at)
+            except Exception:
+                logger.exception("db persistence failed for note %s", note_id)
     else:
         return {"error": "Cần cung cấp file hoặc text"}
     
@@ -431,6 +754,7 @@ async def process_input_sync(
 
 @router.post("/process/combined")
 async def process_combined_endpoint(
+    response: Response,
     text_note: Optional[str] = Form(default=None),
     files: Optional[List[UploadFile]] = File(default=None),
     user_id: Optional[str] = Form(default=None),
@@ -447,142 +771,58 @@ async def process_combined_endpoint(
     - Nếu note đã tồn tại và nội dung không thay đổi → trả về kết quả đã lưu (không chạy lại AI)
     - Nếu note chưa tồn tại hoặc nội dung đã thay đổi → chạy AI và lưu kết quả mới
     """
-    # ⭐ Get user's account type for AI model selection
-    account_type = "free"  # Default
-    if user_id:
-        try:
-            user = db_service.get_or_create_user(db, username=user_id)
-            account_type = user.account_type.value if hasattr(user.account_type, 'value') else str(user.account_type)
-            print(f"[router] User {user_id} account_type: {account_type}")
-        except Exception as e:
-            print(f"[router] Error getting user account type: {e}, using default 'free'")
-    
     uploads = files if files is not None else []
     has_text = text_note and text_note.strip()
 
     if not has_text and not uploads:
         raise HTTPException(status_code=400, detail="Cần cung cấp ít nhất text_note hoặc files")
 
-    if user_id and note_id:
+    # User lookup (threadpool) chạy song song với dedupe/fingerprint file - hai việc không dùng chung gì
+    user_task = asyncio.ensure_future(run_in_threadpool(_get_cached_user, db, user_id)) if user_id else None
+
+    # Hash toàn bộ từng file (song song) - dùng cho cả dedupe lẫn cache key
+    digests = []
+    if len(uploads) > 1 or (user_id and note_id and uploads):
+        digests = list(await asyncio.gather(*(_digest_upload(f) for f in uploads)))
+    if len(uploads) > 1:
+        uploads, digests = _dedupe_uploads(uploads, digests)
+    file_metadata = [
+        f"{f.filename or 'unknown'}:{digest or '0'}"
+        for f, digest in zip(uploads, digests)
+    ]
+
+    # ⭐ Get user's account type for AI model selection
+    account_type = "free"  # Default
+    if user_task is not None:
         try:
-            user = db_service.get_or_create_user(db, username=user_id)
-            existing_note = db_service.get_note_by_user_and_note_id(db, str(user.id), note_id)
-            
-            if existing_note:
-                content_parts = []
-                if text_note:
-                    content_parts.append(f"TEXT:{text_note.strip()}")
-                content_parts.append(f"MODE:{content_type or ''}")
-                stable_checked = _stable_checked_vocab_items(checked_vocab_items)
-                if stable_checked:
-                    content_parts.append(f"CHECKED:{stable_checked}")
-                if uploads:
-                    file_metadata = []
-                    for f in uploads:
-                        filename = f.filename or "unknown"
-                        try:
-                            file_content = await f.read(1024)
-                            await f.seek(0)  
-                            file_hash = hashlib.sha256(file_content).hexdigest()[:16]  
-                        except:
-                            file_hash = "0"
-                        file_metadata.append(f"{filename}:{file_hash}")
-                    content_parts.append(f"FILES:{'|'.join(file_metadata)}")
-                
-                current_content_hash = hashlib.sha256(
-                    "|".join(content_parts).encode('utf-8')
-                ).hexdigest()
-                
-                saved_review = existing_note.review or {}
-                saved_content_hash = saved_review.get('content_hash') if isinstance(saved_review, dict) else None
-                saved_schema_version = saved_review.get('ai_schema_version') if isinstance(saved_review, dict) else None
-                
-                if not saved_content_hash:
-                    saved_content = existing_note.raw_text or ""
-                    saved_content_hash = hashlib.sha256(
-                        saved_content.encode('utf-8')
-                    ).hexdigest()
-                
-                if (
-                    current_content_hash == saved_content_hash
-                    and existing_note.processed_text
-                    and saved_schema_version == AI_RESULT_SCHEMA_VERSION
-                ):
-                    print(f"[cache] Note {note_id} found in DB, content unchanged, returning cached result")
-                    result = {
-                        'summary': existing_note.summary,
-                        'summaries': existing_note.summaries,
-                        'review': existing_note.review or {},
-                        'questions': existing_note.questions or [],
-                        'mcqs': existing_note.mcqs or {},
-                        'raw_text': existing_note.raw_text,
-                        'processed_text': existing_note.processed_text,
-                    }
-                    
-                    if existing_note.review:
-                        review_data = existing_note.review
-                        if isinstance(review_data, dict):
-                            vocab_story = review_data.get('vocab_story')
-                            cloze_tests = review_data.get('cloze_tests')
-                            match_pairs = review_data.get('match_pairs')
-                            
-                            if vocab_story:
-                                story_paras = vocab_story.get('paragraphs', [])
-                                if not isinstance(story_paras, list) or len(story_paras) < 1:
-                                    print(f"[cache] Cached vocab_story invalid ({len(story_paras) if isinstance(story_paras, list) else 0} paragraphs, required: 1+), will regenerate")
-                                    vocab_story = None
-                            
-                            if cloze_tests:
-                                valid_cloze = []
-                                for item in cloze_tests:
-                                    if isinstance(item, dict):
-                                        blanks = item.get('blanks', [])
-                                        if isinstance(blanks, list) and len(blanks) == 1:
-                                            valid_cloze.append(item)
-                                if valid_cloze:
-                                    cloze_tests = valid_cloze
-                                else:
-                                    print(f"[cache] Cached cloze_tests invalid, will regenerate")
-                                    cloze_tests = None
-                            
-                            if match_pairs:
-                                valid_pairs = []
-                                for item in match_pairs:
-                                    if isinstance(item, dict):
-                                        meaning = item.get('meaning', '')
-                                        meaning_lower = str(meaning).lower()
-                                        placeholder_patterns = [
-                                            "nghĩa của", "nghĩa ngắn gọn", "ý nghĩa ngắn gọn", 
-                                            "thực tế của", "meaning of", "nghĩa của từ"
-                                        ]
-                                        if not any(pattern in meaning_lower for pattern in placeholder_patterns) and meaning.strip():
-                                            valid_pairs.append(item)
-                                if valid_pairs:
-                                    match_pairs = valid_pairs
-                                else:
-                                    print(f"[cache] Cached match_pairs invalid, will regenerate")
-                                    match_pairs = None
-                            
-                            if not vocab_story or not cloze_tests or not match_pairs:
-                                print(f"[cache] Some cached results invalid, will regenerate")
-                            else:
-                                result['vocab_story'] = vocab_story
-                                result['vocab_mcqs'] = review_data.get('vocab_mcqs')
-                                result['flashcards'] = review_data.get('flashcards')
-                                result['mindmap'] = review_data.get('mindmap')
-                                result['summary_table'] = review_data.get('summary_table')
-                                result['cloze_tests'] = cloze_tests
-                                result['match_pairs'] = match_pairs
-                                _apply_reset_ids_for_cloze_and_match_pairs(result, current_content_hash)
-                                return result
-                            if 'sources' in review_data:
-                                result['sources'] = review_data['sources']
-
-                    print(f"[cache] Note {note_id} found but validation failed or missing data, running AI again")
-                else:
-                    print(f"[cache] Note {note_id} found but content changed, running AI again")
-        except Exception as e:
-            print(f"Error checking cache: {e}")
+            _, account_type = await user_task
+            logger.debug("user %s account_type: %s", user_id, account_type)
+        except Exception:
+            logger.warning("could not resolve account type for user %s, using 'free'", user_id, exc_info=True)
+
+    if user_id and note_id:
+        # Chỉ là cache key nội bộ (không cần tương thích frontend) -> blake2b.
+        # Hash từng phần (cùng bytes với "|".join(parts)) để không copy text_note lớn thêm 2 lần
+        hasher = hashlib.blake2b(digest_size=16)
+        if text_note:
+            hasher.update(b"TEXT:")
+            hasher.update(text_note.strip().encode('utf-8'))
+            hasher.update(b"|")
+        hasher.update(f"MODE:{content_type or ''}".encode('utf-8'))
+        stable_checked = _stable_checked_vocab_items(checked_vocab_items)
+        if stable_checked:
+            hasher.update(f"|CHECKED:{stable_checked}".encode('utf-8'))
+        if file_metadata:
+            hasher.update(f"|FILES:{'|'.join(file_metadata)}".encode('utf-8'))
+        content_hash = hasher.hexdigest()
+        
+        cached = await run_in_threadpool(
+            _try_serve_cached,
+            db, user_id, note_id, content_hash,
+            validator=_validate_cached_vocab_results
+        )
+        if cached is not None:
+            return _respond_cached(content_hash, *cached)
 
     result = await process_combined_inputs(
         text_note=text_note,
@@ -596,7 +836,6 @@ async def process_combined_endpoint(
 
     if user_id and note_id:
         try:
-            user = db_service.get_or_create_user(db, username=user_id)
             review_payload = result.get('review') or {}
             if result.get('sources'):
                 review_payload = {
@@ -612,34 +851,15 @@ async def process_combined_endpoint(
                 review_payload['cloze_tests'] = result.get('cloze_tests')
                 review_payload['match_pairs'] = result.get('match_pairs')
             
-            content_parts = []
-            if text_note:
-                content_parts.append(f"TEXT:{text_note.strip()}")
-            content_parts.append(f"MODE:{content_type or ''}")
-            stable_checked = _stable_checked_vocab_items(checked_vocab_items)
-            if stable_checked:
-                content_parts.append(f"CHECKED:{stable_checked}")
-            if uploads:
-                file_metadata = []
-                for f in uploads:
-                    filename = f.filename or "unknown"
-                    try:
-                        file_content = await f.read(1024)
-                        await f.seek(0)  
-                        file_hash = hashlib.sha256(file_content).hexdigest()[:16]
-                    except:
-                        file_hash = "0"
-                    file_metadata.append(f"{filename}:{file_hash}")
-                content_parts.append(f"FILES:{'|'.join(file_metadata)}")
-            content_hash = hashlib.sha256("|".join(content_parts).encode('utf-8')).hexdigest()
             review_payload['content_hash'] = content_hash
             review_payload['ai_schema_version'] = AI_RESULT_SCHEMA_VERSION
 
             _apply_reset_ids_for_cloze_and_match_pairs(result, content_hash)
 
-            db_service.create_note(
+            saved_note = await run_in_threadpool(
+                _save_note_for_user,
                 db=db,
-                user_id=str(user.id),
+                username=user_id,
                 note_id=note_id,
                 file_type='combined',
                 filename=None,
@@ -652,9 +872,10 @@ async def process_combined_endpoint(
                 mcqs=result.get('mcqs'),
                 review=review_payload
             )
-            print(f"[cache] Saved result for note {note_id} to DB")
-        except Exception as e:
-            print(f"Error saving combined note: {e}")
+            logger.debug("saved result for note %s", note_id)
+            response.headers["ETag"] = _note_etag(content_hash, saved_note.updated_at)
+        except Exception:
+            logger.exception("db persistence failed for combined note %s", note_id)
 
     return result
 
@@ -694,6 +915,34 @@ async def process_input_async(
     
     return result
 
+@router.get("/process/status/{note_id}")
+async def get_process_status(
+    note_id: str,
+    user_id: Optional[str] = Query(None, description="User ID để tìm note theo (user_id, note_id)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Kiểm tra status của note được gửi qua /process với async_mode=true
+    (tra job_id đã lưu trong note rồi hỏi Celery)
+    """
+    note = None
+    if user_id:
+        user_uuid = get_user_uuid(db, user_id)
+        note = db_service.get_note_by_user_and_note_id(db, str(user_uuid), note_id)
+    if not note:
+        note = db_service.get_note_by_id(db, note_id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note không tồn tại")
+    
+    if not note.job_id:
+        raise HTTPException(status_code=400, detail="Note không có job_id")
+    
+    status = job_service.get_job_status(note.job_id)
+    return {
+        "note_id": note.note_id,
+        **status
+    }
+
 @router.get("/jobs/{job_id}/status")
 async def get_job_status(job_id: str):
     """
@@ -738,6 +987,7 @@ async def get_user_notes(
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
     file_type: Optional[str] = Query(None),
+    compact: bool = Query(False, description="Chỉ trả các field cho danh sách (không có text/review)"),
     db: Session = Depends(get_db)
 ):
     """
@@ -747,35 +997,28 @@ async def get_user_notes(
     - limit: Số lượng notes tối đa (1-100, default: 50)
     - offset: Offset cho pagination (default: 0)
     - file_type: Lọc theo loại file (optional: 'text', 'image', 'audio', 'pdf', 'docx')
+    - compact: true -> mỗi note chỉ gồm id, note_id, file_type, filename, summary và timestamps
     }
     """
-    from app.database.models import Note
-    
     user_uuid = get_user_uuid(db, user_id)
     
-    notes = db_service.get_user_notes(
+    notes_json, total = db_service.get_user_notes_json(
         db=db,
-        user_id=user_id,
+        user_uuid=user_uuid,
         limit=limit,
         offset=offset,
-        file_type=file_type
+        file_type=file_type,
+        compact=compact
     )
     
-    total_query = db.query(Note).filter(Note.user_id == user_uuid)
-    if file_type:
-        total_query = total_query.filter(Note.file_type == file_type)
-    total = total_query.count()
-    
-    return {
-        "notes": [note.to_dict() for note in notes],
-        "total": total,
-        "limit": limit,
-        "offset": offset
-    }
+    return _json_response(
+        f'{{"notes":{notes_json},"total":{total},"limit":{limit},"offset":{offset}}}'
+    )
 
 
 @router.get("/notes/{note_id}")
 async def get_note_by_id(
+    request: Request,
     note_id: str,
     user_id: Optional[str] = Query(None, description="User ID để ưu tiên tìm note theo user"),
     db: Session = Depends(get_db)
@@ -783,44 +1026,37 @@ async def get_note_by_id(
     """
     Lấy note theo note_id. Nếu truyền user_id, sẽ ưu tiên tìm theo (user_id, note_id),
     nếu không có sẽ fallback tìm theo note_id duy nhất.
+    Trả ETag: trước tiên chỉ query (id, content_hash, updated_at); If-None-Match khớp thì
+    trả 304 ngay. Ngược lại dùng body đã serialize trong cache theo (id, updated_at),
+    cache miss mới load cả note.
     """
-    note = None
-    try:
-        if user_id:
-            user_uuid = get_user_uuid(db, user_id)
-            note = db_service.get_note_by_user_and_note_id(db, str(user_uuid), note_id)
-    except Exception as e:
-        print(f"Error finding note by user_id: {e}")
-
-    if not note:
-        note = db_service.get_note_by_note_id(db, note_id)
-
-    if not note:
+    # Query nhẹ (id, content_hash, updated_at) trước: đủ để trả 304 hoặc body đã serialize trong cache
+    version = db_service.get_note_version_prefer_user(db, note_id, user_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Note not found")
-
-    result = {
-        'summary': note.summary,
-        'summaries': note.summaries,
-        'review': note.review or {},
-        'questions': note.questions or [],
-        'mcqs': note.mcqs or {},
-        'raw_text': note.raw_text,
-        'processed_text': note.processed_text,
-    }
-
-    review_data = note.review
-    if isinstance(review_data, dict):
-        result['vocab_story'] = review_data.get('vocab_story')
-        result['vocab_mcqs'] = review_data.get('vocab_mcqs')
-        result['flashcards'] = review_data.get('flashcards')
-        result['mindmap'] = review_data.get('mindmap')
-        result['summary_table'] = review_data.get('summary_table')
-        result['cloze_tests'] = review_data.get('cloze_tests')
-        result['match_pairs'] = review_data.get('match_pairs')
-        if 'sources' in review_data:
-            result['sources'] = review_data['sources']
-
-    return result
+    
+    note_pk, content_hash, updated_at = version
+    etag = _note_etag(content_hash, updated_at)
+    if _if_none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    body = cache_service.get_note_view(str(note_pk), updated_at) if updated_at else None
+    if body is None:
+        # Một query: ưu tiên note của user (nếu có user_id), không có thì lấy note bất kỳ cùng note_id
+        note = db_service.get_note_prefer_user(db, note_id, user_id)
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        
+        body = _serialize_result(_build_cached_response(note))
+        etag = _note_etag(note.content_hash, note.updated_at)
+        if note.updated_at:
+            cache_service.set_note_view(str(note.id), note.updated_at, body)
+    
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag} if etag else None
+    )
 
 
 @router.get("/users/{user_id}/notes/search")
@@ -829,6 +1065,7 @@ async def search_user_notes(
     q: str = Query(..., min_length=1, description="Search query"),
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    compact: bool = Query(False, description="Chỉ trả các field cho danh sách (không có text/review)"),
     db: Session = Depends(get_db)
 ):
     """
@@ -838,23 +1075,22 @@ async def search_user_notes(
     - q: Text để tìm kiếm (required, min 1 char)
     - limit: Số lượng kết quả tối đa (1-100, default: 50)
     - offset: Offset cho pagination (default: 0)
+    - compact: true -> mỗi note chỉ gồm id, note_id, file_type, filename, summary và timestamps
     }
     """
-    notes = db_service.search_notes(
+    notes_json, total = db_service.search_notes(
         db=db,
         user_id=user_id,
         query_text=q,
         limit=limit,
-        offset=offset
+        offset=offset,
+        compact=compact
     )
     
-    return {
-        "notes": [note.to_dict() for note in notes],
-        "total": len(notes), 
-        "query": q,
-        "limit": limit,
-        "offset": offset
-    }
+    return _json_response(
+        f'{{"notes":{notes_json},"total":{total},"query":{orjson.dumps(q).decode()},'
+        f'"limit":{limit},"offset":{offset}}}'
+    )
 
 
 @router.delete("/notes/{note_id}")
@@ -875,6 +1111,22 @@ async def delete_note(
         "message": "Note đã được xóa"
     }
 
+_ASPECTS_ADAPTER = TypeAdapter(List[str])
+
+
+def _parse_aspects(raw: Optional[str]) -> Optional[List[str]]:
+    """
+    Parse form field JSON array of aspects bằng pydantic-core (parse + validate list[str] trong một bước);
+    giá trị không phải JSON array string -> coi cả chuỗi là một aspect
+    """
+    if not raw:
+        return None
+    try:
+        return _ASPECTS_ADAPTER.validate_json(raw)
+    except ValidationError:
+        return [raw]
+
+
 @router.post("/notes/{note_id}/feedback")
 async def submit_feedback(
     note_id: str,
@@ -898,21 +1150,8 @@ async def submit_feedback(
     - suggestions: Suggestions từ user (optional)
     }
     """
-    import json
-    
-    liked = None
-    disliked = None
-    if liked_aspects:
-        try:
-            liked = json.loads(liked_aspects)
-        except:
-            liked = [liked_aspects] if liked_aspects else None
-    
-    if disliked_aspects:
-        try:
-            disliked = json.loads(disliked_aspects)
-        except:
-            disliked = [disliked_aspects] if disliked_aspects else None
+    liked = _parse_aspects(liked_aspects)
+    disliked = _parse_aspects(disliked_aspects)
     
     feedback = feedback_service.create_feedback(
         db=db,
@@ -925,24 +1164,72 @@ async def submit_feedback(
         suggestions=suggestions
     )
     
-    return feedback.to_dict()
+    return _json_response(feedback.to_json())
 
 
 @router.get("/notes/{note_id}/feedback")
 async def get_note_feedbacks(
     note_id: str,
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0),
     db: Session = Depends(get_db)
 ):
     """
-    Lấy tất cả feedbacks của một note
+    Lấy danh sách feedbacks của một note (có pagination)
+    
+    Query params:
+    - limit: Số lượng feedbacks tối đa (1-100, default: 50)
+    - offset: Offset cho pagination (default: 0)
     """
-    feedbacks = feedback_service.get_feedbacks_by_note(db, note_id)
-    statistics = feedback_service.get_feedback_statistics(db, note_id=note_id)
+    feedbacks_json, statistics = feedback_service.get_feedbacks_with_statistics(
+        db, note_id, limit=limit, offset=offset
+    )
     
-    return {
-        "feedbacks": [fb.to_dict() for fb in feedbacks],
-        "statistics": statistics
-    }
+    return _json_response(
+        f'{{"feedbacks":{feedbacks_json},'
+        f'"statistics":{orjson.dumps(statistics, option=orjson.OPT_NON_STR_KEYS).decode()},'
+        f'"limit":{limit},"offset":{offset}}}'
+    )
+
+
+# Số feedback serialize trong một lần chạy threadpool (một chunk của response)
+_EXPORT_CHUNK_ROWS = 500
+
+
+def _next_ndjson_chunk(rows: Iterator[Feedback]) -> bytes:
+    """
+    Lấy tối đa _EXPORT_CHUNK_ROWS feedback tiếp theo và nối thành các dòng NDJSON (b"" khi hết)
+    """
+    return b"".join(fb.to_json() + b"\n" for fb in itertools.islice(rows, _EXPORT_CHUNK_ROWS))
+
+
+async def _ndjson_feedback_stream(note_id: str):
+    """
+    Async generator trả feedbacks dưới dạng NDJSON, đọc dần từ server-side cursor.
+    Mỗi lần fetch + serialize một chunk giới hạn chạy trong threadpool, giữa các chunk
+    event loop rảnh và client ngắt kết nối thì dừng ngay ở chunk tiếp theo.
+    Dùng session riêng: session của Depends(get_db) có thể đã đóng trước khi stream xong.
+    """
+    db = SessionLocal()
+    try:
+        rows = feedback_service.iter_feedbacks_by_note(db, note_id, chunk_size=_EXPORT_CHUNK_ROWS)
+        while True:
+            chunk = await run_in_threadpool(_next_ndjson_chunk, rows)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        # Chạy cả khi client ngắt kết nối (generator bị đóng/hủy): trả connection về pool
+        db.close()
+
+
+@router.get("/notes/{note_id}/feedback/export")
+async def export_note_feedbacks(note_id: str):
+    """
+    Export toàn bộ feedbacks của một note dưới dạng NDJSON (mỗi dòng một feedback)
+    Dùng cho admin export, không giới hạn số lượng
+    """
+    return StreamingResponse(_ndjson_feedback_stream(note_id), media_type="application/x-ndjson")
 
 
 @router.get("/users/{user_id}/feedbacks")
@@ -955,19 +1242,16 @@ async def get_user_feedbacks(
     """
     Lấy danh sách feedbacks của user
     """
-    feedbacks = feedback_service.get_user_feedbacks(
+    feedbacks_json, total = feedback_service.get_user_feedbacks(
         db=db,
         user_id=user_id,
         limit=limit,
         offset=offset
     )
     
-    return {
-        "feedbacks": [fb.to_dict() for fb in feedbacks],
-        "total": len(feedbacks),
-        "limit": limit,
-        "offset": offset
-    }
+    return _json_response(
+        f'{{"feedbacks":{feedbacks_json},"total":{total},"limit":{limit},"offset":{offset}}}'
+    )
 
 
 @router.get("/feedback/statistics")
@@ -1065,8 +1349,6 @@ async def debug_test_ocr(
     Request:
     - file: UploadFile (image)
     """
-    import tempfile
-    import os
     from app.core.preprocessor import process_image_file, configure_tesseract
     import pytesseract
     from PIL import Image
@@ -1074,8 +1356,9 @@ async def debug_test_ocr(
     # Save file to temp location
     suffix = os.path.splitext(file.filename)[1]
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    contents = await file.read()
-    tmp.write(contents)
+    # Copy theo chunk trong threadpool (copyfileobj) -> RAM không phụ thuộc kích thước ảnh
+    await file.seek(0)
+    await run_in_threadpool(shutil.copyfileobj, file.file, tmp, 1024 * 1024)
     tmp.close()
     file_path = tmp.name
     
@@ -1131,18 +1414,31 @@ async def debug_test_ocr(
         # Cleanup
         try:
             os.remove(file_path)
-        except:
-            pass
+        except OSError:
+            logger.debug("could not remove temp file %s", file_path, exc_info=True)
 
 
-@router.get("/debug/celery-status")
-async def debug_celery_status():
+_CELERY_STATUS_TTL = 2.0
+_celery_status_cache = {"ts": 0.0, "value": None}
+_redis_client = None
+
+
+def _get_redis_client(redis_url: str):
     """
-    Debug endpoint để kiểm tra Celery worker và Redis connection
-    
+    Redis client dùng chung cho debug endpoint (tạo một lần, giữ connection pool)
+    """
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.from_url(redis_url)
+    return _redis_client
+
+
+async def _collect_celery_status() -> dict:
+    """
+    Kiểm tra Redis và inspect Celery workers; các broadcast inspect chạy song song trong threadpool
     """
     from app.services.celery_app import celery_app
-    import redis
     
     result = {
         "redis_url": os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
@@ -1155,19 +1451,21 @@ async def debug_celery_status():
     
     # Test Redis connection
     try:
-        redis_client = redis.from_url(result["redis_url"])
-        redis_client.ping()
+        redis_client = _get_redis_client(result["redis_url"])
+        await run_in_threadpool(redis_client.ping)
         result["redis_connected"] = True
     except Exception as e:
         result["errors"].append(f"Redis connection error: {e}")
         return result
     
-    # Inspect workers
+    # Inspect workers: active/registered/stats là 3 broadcast độc lập (mỗi cái chờ timeout ~1s)
     try:
-        inspect = celery_app.control.inspect()
+        active_workers, registered, stats = await asyncio.gather(
+            run_in_threadpool(lambda: celery_app.control.inspect().active()),
+            run_in_threadpool(lambda: celery_app.control.inspect().registered()),
+            run_in_threadpool(lambda: celery_app.control.inspect().stats()),
+        )
         
-        # Get active workers
-        active_workers = inspect.active()
         if active_workers:
             result["celery_workers"] = list(active_workers.keys())
             # Get active tasks
@@ -1182,13 +1480,9 @@ async def debug_celery_status():
         else:
             result["errors"].append("No active Celery workers found!")
         
-        # Get registered workers
-        registered = inspect.registered()
         if registered:
             result["registered_workers"] = list(registered.keys())
         
-        # Get stats
-        stats = inspect.stats()
         if stats:
             result["worker_stats"] = stats
         
@@ -1196,8 +1490,7 @@ async def debug_celery_status():
         try:
             # Get queue length from Redis
             queue_key = celery_app.conf.task_default_queue or 'celery'
-            pending_count = redis_client.llen(queue_key)
-            result["pending_tasks"] = pending_count
+            result["pending_tasks"] = await run_in_threadpool(redis_client.llen, queue_key)
         except:
             pass
             
@@ -1205,3 +1498,22 @@ async def debug_celery_status():
         result["errors"].append(f"Celery inspect error: {e}")
     
     return result
+
+
+@router.get("/debug/celery-status")
+async def debug_celery_status():
+    """
+    Debug endpoint để kiểm tra Celery worker và Redis connection
+    Kết quả được cache trong _CELERY_STATUS_TTL giây: dashboard poll liên tục
+    chỉ tạo một lượt broadcast inspect mỗi chu kỳ, bất kể số client.
+    """
+    now = time.monotonic()
+    cached = _celery_status_cache["value"]
+    if cached is not None and now - _celery_status_cache["ts"] < _CELERY_STATUS_TTL:
+        return cached
+    
+    # Nhiều request cùng lúc khi cache hết hạn -> chỉ một lượt inspect
+    result = await request_coalescer.run(("debug", "celery-status"), _collect_celery_status)
+    _celery_status_cache["ts"] = time.monotonic()
+    _celery_status_cache["value"] = result
+    return result
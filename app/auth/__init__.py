@@ -19,7 +19,7 @@ from .schemas import (
     PasswordChange,
     AccountLimits
 )
-from .rate_limiter import check_daily_note_limit, increment_note_count
+from .rate_limiter import check_daily_note_limit, daily_limit_exceeded, increment_note_count
 
 __all__ = [
     "get_password_hash",
@@ -35,5 +35,6 @@ __all__ = [
     "PasswordChange",
     "AccountLimits",
     "check_daily_note_limit",
+    "daily_limit_exceeded",
     "increment_note_count"
 ]
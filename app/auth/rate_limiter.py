@@ -2,8 +2,10 @@
 Rate limiter for FREE vs PRO accounts
 Also handles AI model selection based on account type
 """
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from sqlalchemy import update, or_, case
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from fastapi import HTTPException, status
 from enum import Enum
 
@@ -61,33 +63,65 @@ def check_daily_note_limit(db: Session, user: User) -> None:
     if user.account_type in [AccountType.PRO, AccountType.ENTERPRISE]:
         return
     
-    # Check if we need to reset daily counter
+    # Counter của ngày trước coi như 0; việc reset nằm luôn trong UPDATE của increment_note_count
     today = datetime.utcnow().date()
     last_reset = user.last_reset_date.date() if user.last_reset_date else None
-    
-    if last_reset != today:
-        # Reset counter for new day
-        user.notes_created_today = 0
-        user.last_reset_date = datetime.utcnow()
-        db.commit()
+    notes_today = user.notes_created_today if last_reset == today else 0
     
     # Check limit
-    if user.notes_created_today >= user.daily_note_limit:
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Bạn đã đạt giới hạn {user.daily_note_limit} ghi chú/ngày. "
-                   f"Nâng cấp lên PRO để không giới hạn! "
-                   f"(Giới hạn sẽ reset vào {(datetime.utcnow().date() + timedelta(days=1)).isoformat()})"
-        )
+    if notes_today >= user.daily_note_limit:
+        raise daily_limit_exceeded(user)
 
 
-def increment_note_count(db: Session, user: User) -> None:
+def daily_limit_exceeded(user: User) -> HTTPException:
     """
-    Increment user's daily note count after successful note creation
+    HTTP 429 trả về khi user đã dùng hết số note trong ngày
     """
-    # Only increment for FREE users (PRO/ENTERPRISE still tracked but not limited)
-    user.notes_created_today += 1
-    db.commit()
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"Bạn đã đạt giới hạn {user.daily_note_limit} ghi chú/ngày. "
+               f"Nâng cấp lên PRO để không giới hạn! "
+               f"(Giới hạn sẽ reset vào {(datetime.utcnow().date() + timedelta(days=1)).isoformat()})"
+    )
+
+
+def increment_note_count(db: Session, user: User) -> bool:
+    """
+    Increment user's daily note count (reserve one note slot for today)
+    
+    Atomic UPDATE ... RETURNING guarded by the daily limit, so concurrent requests
+    cannot overshoot it. The same statement resets the counter when the last reset
+    was before today (no separate reset UPDATE). The in-session user gets the new
+    counter values. Does not commit: the caller commits.
+    
+    Returns:
+        False if the limit was already reached (counter unchanged) - caller must reject
+        the request (raise daily_limit_exceeded(user))
+    """
+    today_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    is_new_day = or_(User.last_reset_date.is_(None), User.last_reset_date < today_start)
+    
+    # PRO/ENTERPRISE (limit -1) are still tracked but not limited
+    row = db.execute(
+        update(User)
+        .where(
+            User.id == user.id,
+            or_(User.daily_note_limit < 0, is_new_day, User.notes_created_today < User.daily_note_limit)
+        )
+        .values(
+            notes_created_today=case((is_new_day, 1), else_=User.notes_created_today + 1),
+            last_reset_date=case((is_new_day, datetime.utcnow()), else_=User.last_reset_date)
+        )
+        .returning(User.notes_created_today, User.last_reset_date)
+        .execution_options(synchronize_session=False)
+    ).one_or_none()
+    if row is None:
+        return False
+    
+    # Đồng bộ object trong session (không đánh dấu dirty) để phần còn lại của request đọc đúng counter
+    set_committed_value(user, 'notes_created_today', row.notes_created_today)
+    set_committed_value(user, 'last_reset_date', row.last_reset_date)
+    return True
 
 
 def reset_daily_limits(db: Session) -> int:
@@ -97,24 +131,18 @@ def reset_daily_limits(db: Session) -> int:
     
     Returns number of users reset
     """
-    from app.database.models import User
-    
     today = datetime.utcnow().date()
     
-    # Find users who need reset
-    users_to_reset = db.query(User).filter(
-        (User.last_reset_date == None) | 
-        (User.last_reset_date < today)
-    ).all()
-    
-    count = 0
-    for user in users_to_reset:
-        user.notes_created_today = 0
-        user.last_reset_date = datetime.utcnow()
-        count += 1
+    # Một câu UPDATE duy nhất thay vì load từng user lên ORM rồi gán field
+    result = db.execute(
+        update(User)
+        .where(or_(User.last_reset_date.is_(None), User.last_reset_date < today))
+        .values(notes_created_today=0, last_reset_date=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
     
     db.commit()
-    return count
+    return result.rowcount
 
 
 def get_remaining_notes(user: User) -> int:
@@ -143,6 +171,5 @@ def get_limit_reset_time() -> datetime:
     """
     Get the time when limits will reset (midnight UTC)
     """
-    from datetime import timedelta
     tomorrow = datetime.utcnow().date() + timedelta(days=1)
     return datetime.combine(tomorrow, datetime.min.time())
@@ -2,31 +2,29 @@
 Pydantic schemas for authentication
 """
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, EmailStr, Field, validator
+from typing import Annotated, Optional
+from pydantic import AfterValidator, BaseModel, EmailStr, Field, StringConstraints
+
+
+def _password_strength(v: str) -> str:
+    # Độ dài đã được StringConstraints kiểm tra (pydantic-core), ở đây chỉ còn digit/uppercase
+    if not any(char.isdigit() for char in v):
+        raise ValueError('Password must contain at least one digit')
+    if not any(char.isupper() for char in v):
+        raise ValueError('Password must contain at least one uppercase letter')
+    return v
+
+
+# Username: chữ/số (kể cả Unicode), _ và - ; regex chạy trong pydantic-core (Rust regex, không hỗ trợ lookahead)
+Username = Annotated[str, StringConstraints(min_length=3, max_length=50, pattern=r'^[\w-]+$')]
+StrongPassword = Annotated[str, StringConstraints(min_length=8, max_length=100), AfterValidator(_password_strength)]
 
 
 class UserRegister(BaseModel):
     """Schema for user registration"""
-    username: str = Field(..., min_length=3, max_length=50)
+    username: Username
     email: EmailStr
-    password: str = Field(..., min_length=8, max_length=100)
-    
-    @validator('username')
-    def username_alphanumeric(cls, v):
-        if not v.replace('_', '').replace('-', '').isalnum():
-            raise ValueError('Username must be alphanumeric (can include _ and -)')
-        return v
-    
-    @validator('password')
-    def password_strength(cls, v):
-        if len(v) < 8:
-            raise ValueError('Password must be at least 8 characters')
-        if not any(char.isdigit() for char in v):
-            raise ValueError('Password must contain at least one digit')
-        if not any(char.isupper() for char in v):
-            raise ValueError('Password must contain at least one uppercase letter')
-        return v
+    password: StrongPassword
 
 
 class UserLogin(BaseModel):
@@ -68,17 +66,7 @@ class UserUpdate(BaseModel):
 class PasswordChange(BaseModel):
     """Schema for changing password"""
     old_password: str
-    new_password: str = Field(..., min_length=8, max_length=100)
-    
-    @validator('new_password')
-    def password_strength(cls, v):
-        if len(v) < 8:
-            raise ValueError('Password must be at least 8 characters')
-        if not any(char.isdigit() for char in v):
-            raise ValueError('Password must contain at least one digit')
-        if not any(char.isupper() for char in v):
-            raise ValueError('Password must contain at least one uppercase letter')
-        return v
+    new_password: StrongPassword
 
 
 class AccountLimits(BaseModel):
@@ -1,30 +1,70 @@
+import functools
 import mimetypes
 import os
 
+# Extension phổ biến -> loại input (tra dict, không cần đụng tới mime DB)
+_EXT_TO_TYPE = {
+    '.pdf': 'pdf',
+    '.docx': 'docx',
+    '.doc': 'docx',
+    '.png': 'image',
+    '.jpg': 'image',
+    '.jpeg': 'image',
+    '.gif': 'image',
+    '.webp': 'image',
+    '.bmp': 'image',
+    '.tif': 'image',
+    '.tiff': 'image',
+    '.mp3': 'audio',
+    '.wav': 'audio',
+    '.m4a': 'audio',
+    '.ogg': 'audio',
+    '.flac': 'audio',
+    '.aac': 'audio',
+    '.txt': 'text',
+    '.md': 'text',
+}
+
+# Nạp mime DB lúc import thay vì ở request đầu tiên
+mimetypes.init()
+_GUESS_TYPE = mimetypes.guess_type
+
+_DOCX_MIME_TYPES = frozenset((
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/msword',
+))
+
+
 def detect_input_type(file_path: str) -> str:
     """
     Detect loại input file
     Returns: 'image', 'audio', 'pdf', 'docx', 'doc', hoặc 'text'
     """
     ext = os.path.splitext(file_path)[1].lower()
-    
-    if ext == '.pdf':
-        return 'pdf'
-    if ext in ['.docx', '.doc']:
-        return 'docx'
-    
-    mime_type, _ = mimetypes.guess_type(file_path)
+    input_type = _EXT_TO_TYPE.get(ext)
+    if input_type is not None:
+        return input_type
+    return _detect_by_mime(ext)
+
+
+@functools.lru_cache(maxsize=1024)
+def _detect_by_mime(ext: str) -> str:
+    """
+    Fallback cho extension hiếm: tra mime DB (kết quả chỉ phụ thuộc extension nên cache theo ext)
+    """
+    if not ext:
+        return 'text'
+    mime_type, _ = _GUESS_TYPE('file' + ext)
     if not mime_type:
         return 'text'
-    
+
     if mime_type.startswith('image'):
         return 'image'
     if mime_type.startswith('audio'):
         return 'audio'
     if mime_type == 'application/pdf':
         return 'pdf'
-    if mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 
-                     'application/msword']:
+    if mime_type in _DOCX_MIME_TYPES:
         return 'docx'
-    
+
     return 'text'
@@ -2,7 +2,7 @@
 Feature configuration based on account type
 """
 from enum import Enum
-from typing import List, Dict, Any
+from typing import List, Dict, Any, FrozenSet, Tuple
 
 class AccountType(str, Enum):
     FREE = "free"
@@ -48,6 +48,22 @@ VOCAB_FEATURES_CONFIG = {
     ],
 }
 
+# Tính sẵn lúc import: string account type -> enum, và tên features (tuple/frozenset) theo account type
+_ACCOUNT_TYPE_BY_VALUE: Dict[str, AccountType] = {t.value: t for t in AccountType}
+_ENABLED_FEATURE_NAMES: Dict[AccountType, Tuple[str, ...]] = {
+    account: tuple(f.value for f in features)
+    for account, features in VOCAB_FEATURES_CONFIG.items()
+}
+_ENABLED_FEATURE_SETS: Dict[AccountType, FrozenSet[str]] = {
+    account: frozenset(names) for account, names in _ENABLED_FEATURE_NAMES.items()
+}
+
+
+def _to_account_type(account_type: str) -> AccountType:
+    """Map string account type -> AccountType (không hợp lệ -> FREE)"""
+    return _ACCOUNT_TYPE_BY_VALUE.get(account_type.lower(), AccountType.FREE)
+
+
 def get_enabled_vocab_features(account_type: str) -> List[str]:
     """
     Get list of enabled vocab features for account type.
@@ -58,13 +74,8 @@ def get_enabled_vocab_features(account_type: str) -> List[str]:
     Returns:
         List of enabled feature names
     """
-    try:
-        account_enum = AccountType(account_type.lower())
-    except ValueError:
-        account_enum = AccountType.FREE
-    
-    features = VOCAB_FEATURES_CONFIG.get(account_enum, VOCAB_FEATURES_CONFIG[AccountType.FREE])
-    return [f.value for f in features]
+    names = _ENABLED_FEATURE_NAMES.get(_to_account_type(account_type), _ENABLED_FEATURE_NAMES[AccountType.FREE])
+    return list(names)
 
 def is_feature_enabled(account_type: str, feature: str) -> bool:
     """
@@ -77,16 +88,21 @@ def is_feature_enabled(account_type: str, feature: str) -> bool:
     Returns:
         True if feature is enabled
     """
-    enabled_features = get_enabled_vocab_features(account_type)
-    return feature in enabled_features
+    enabled = _ENABLED_FEATURE_SETS.get(_to_account_type(account_type), _ENABLED_FEATURE_SETS[AccountType.FREE])
+    return feature in enabled
 
 def get_account_benefits() -> Dict[str, Dict[str, Any]]:
     """
     Get detailed benefits for each account type.
+    Nội dung tĩnh, dựng một lần lúc import -> caller không được sửa dict trả về (copy trước nếu cần).
     
     Returns:
         Dictionary with account type as key and benefits as value
     """
+    return _ACCOUNT_BENEFITS
+
+
+def _build_account_benefits() -> Dict[str, Dict[str, Any]]:
     return {
         "free": {
             "name": "FREE",
@@ -199,6 +215,9 @@ def get_account_benefits() -> Dict[str, Dict[str, Any]]:
         }
     }
 
+_ACCOUNT_BENEFITS = _build_account_benefits()
+
+
 def get_upgrade_message(feature: str) -> str:
     """
     Get upgrade message for a disabled feature.
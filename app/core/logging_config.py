@@ -0,0 +1,40 @@
+"""
+Logging configuration
+Log records được đẩy vào queue trong bộ nhớ (QueueHandler), một thread nền
+(QueueListener) mới thực sự ghi ra stdout -> request path không bị block bởi I/O.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: Optional[str] = None) -> None:
+    """
+    Gắn QueueHandler vào root logger và khởi động QueueListener (chỉ chạy một lần)
+
+    Args:
+        level: Log level (mặc định lấy từ env LOG_LEVEL, fallback INFO)
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
@@ -40,25 +40,20 @@ def build_output(
         'processed_text': processed_text or raw_text
     }
 
-    if sources is not None:
-        result['sources'] = sources
-    if vocab_story is not None:
-        result['vocab_story'] = vocab_story
-    if vocab_mcqs is not None:
-        result['vocab_mcqs'] = vocab_mcqs
-    if flashcards is not None:
-        result['flashcards'] = flashcards
-    if mindmap is not None:
-        result['mindmap'] = mindmap
-    if summary_table is not None:
-        result['summary_table'] = summary_table
-    if cloze_tests is not None:
-        result['cloze_tests'] = cloze_tests
-    if match_pairs is not None:
-        result['match_pairs'] = match_pairs
-    if text_summary is not None:
-        result['text_summary'] = text_summary
-    if files_summaries is not None:
-        result['files_summaries'] = files_summaries
+    # Các field optional: chỉ đưa vào response khi có giá trị (thứ tự key giữ nguyên như trước)
+    for key, value in (
+        ('sources', sources),
+        ('vocab_story', vocab_story),
+        ('vocab_mcqs', vocab_mcqs),
+        ('flashcards', flashcards),
+        ('mindmap', mindmap),
+        ('summary_table', summary_table),
+        ('cloze_tests', cloze_tests),
+        ('match_pairs', match_pairs),
+        ('text_summary', text_summary),
+        ('files_summaries', files_summaries),
+    ):
+        if value is not None:
+            result[key] = value
 
     return result
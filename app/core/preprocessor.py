@@ -3,14 +3,47 @@ import pytesseract
 import whisper
 from pypdf import PdfReader
 from docx import Document
+from docx.oxml.ns import qn
+import functools
 import os
 import platform
+import queue
 import re
+import shutil
+import threading
 import unicodedata
-from typing import List, Tuple
+from typing import Optional, Tuple
 
-def configure_tesseract():
-    """Tự động cấu hình đường dẫn Tesseract OCR"""
+try:
+    # Optional: binding C++ API của Tesseract, giữ engine (LSTM model) resident trong process
+    from tesserocr import PyTessBaseAPI
+except ImportError:
+    PyTessBaseAPI = None
+
+try:
+    # Optional: PDFium (C++) extract text nhanh hơn nhiều so với pypdf (pure Python)
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+@functools.lru_cache(maxsize=1)
+def configure_tesseract() -> str:
+    """
+    Tự động cấu hình đường dẫn Tesseract OCR
+    Chỉ chạy một lần mỗi process (đọc .env + stat các path), các lần sau trả về từ cache.
+    
+    Returns:
+        tesseract_cmd đang dùng
+    """
+    _configure_tesseract_path()
+    return pytesseract.pytesseract.tesseract_cmd
+
+
+# Bỏ khoảng trắng/dấu nháy ở hai đầu TESSERACT_CMD trong một lần quét
+_ENV_PATH_TRIM_PATTERN = re.compile(r'^[\s"\']+|[\s"\']+$')
+
+
+def _configure_tesseract_path() -> None:
     if hasattr(pytesseract.pytesseract, 'tesseract_cmd') and pytesseract.pytesseract.tesseract_cmd:
         configured_path = pytesseract.pytesseract.tesseract_cmd
         if configured_path and os.path.exists(configured_path):
@@ -21,7 +54,7 @@ def configure_tesseract():
     env_path = os.getenv('TESSERACT_CMD')
     
     if env_path:
-        env_path = os.path.normpath(env_path.strip().strip('"').strip("'"))
+        env_path = os.path.normpath(_ENV_PATH_TRIM_PATTERN.sub('', env_path))
         
         paths_to_try = [env_path]
         if platform.system() == 'Windows' and '/' in env_path:
@@ -37,6 +70,12 @@ def configure_tesseract():
         print(f"   Hãy kiểm tra lại đường dẫn trong file .env")
     
     if platform.system() == 'Windows':
+        # Tra PATH một lần trước khi stat từng path cài đặt mặc định
+        which_path = shutil.which('tesseract')
+        if which_path:
+            pytesseract.pytesseract.tesseract_cmd = which_path
+            return
+        
         username = os.getenv('USERNAME', '')
         possible_paths = [
             r'C:\Program Files\Tesseract-OCR\tesseract.exe',
@@ -53,6 +92,73 @@ def configure_tesseract():
 
 configure_tesseract()
 
+_OCR_LANG = 'vie+eng'
+_OCR_POOL_SIZE = max(1, (os.cpu_count() or 2) // 2)
+_ocr_pool: Optional[queue.Queue] = None
+_ocr_pool_lock = threading.Lock()
+_ocr_pool_failed = False
+
+
+def _get_ocr_pool() -> Optional[queue.Queue]:
+    """
+    Pool các PyTessBaseAPI (mỗi API không thread-safe -> mỗi request mượn một API riêng).
+    None nếu không có tesserocr hoặc khởi tạo lỗi -> dùng pytesseract (subprocess) như cũ.
+    """
+    global _ocr_pool, _ocr_pool_failed
+    if _ocr_pool is not None or _ocr_pool_failed or PyTessBaseAPI is None:
+        return _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None and not _ocr_pool_failed:
+            try:
+                tessdata = os.getenv('TESSDATA_PREFIX')
+                kwargs = {'path': tessdata} if tessdata else {}
+                pool = queue.Queue()
+                for _ in range(_OCR_POOL_SIZE):
+                    pool.put(PyTessBaseAPI(lang=_OCR_LANG, **kwargs))
+                _ocr_pool = pool
+            except Exception as e:
+                print(f"⚠️  Không khởi tạo được tesserocr, dùng pytesseract: {e}")
+                _ocr_pool_failed = True
+    return _ocr_pool
+
+
+def _ocr_vie_eng(image: Image.Image) -> str:
+    """
+    OCR vie+eng: qua pool tesserocr nếu có, ngược lại pytesseract.image_to_string
+    """
+    pool = _get_ocr_pool()
+    if pool is None:
+        return pytesseract.image_to_string(image, lang=_OCR_LANG)
+    api = pool.get()
+    try:
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    finally:
+        pool.put(api)
+
+
+_tess_version_value = None
+
+
+def _tess_version():
+    """
+    Version Tesseract, chỉ probe (spawn subprocess) lần đầu.
+    Nếu không tìm thấy binary thì cấu hình lại path và thử đúng một lần nữa.
+    """
+    global _tess_version_value
+    if _tess_version_value is not None:
+        return _tess_version_value
+    try:
+        version = pytesseract.get_tesseract_version()
+    except pytesseract.TesseractNotFoundError:
+        configure_tesseract.cache_clear()
+        configure_tesseract()
+        version = pytesseract.get_tesseract_version()
+    print(f"✅ Tesseract OCR version: {version}")
+    _tess_version_value = version
+    return version
+
+
 def process_image_file(file_path: str) -> Tuple[str, str]:
     """
     Extract text từ image bằng OCR
@@ -65,8 +171,7 @@ def process_image_file(file_path: str) -> Tuple[str, str]:
             return '', error_msg
         
         try:
-            version = pytesseract.get_tesseract_version()
-            print(f"✅ Tesseract OCR version: {version}")
+            _tess_version()
         except Exception as tess_err:
             error_msg = f"Tesseract OCR chưa được cài đặt hoặc không tìm thấy: {tess_err}. Hãy cài Tesseract và set TESSERACT_CMD trong .env"
             return '', error_msg
@@ -77,7 +182,7 @@ def process_image_file(file_path: str) -> Tuple[str, str]:
             error_msg = f"Không thể mở file ảnh: {img_err}"
             return '', error_msg
         try:
-            text = pytesseract.image_to_string(image, lang='vie+eng')
+            text = _ocr_vie_eng(image)
             if text.strip():
                 return text, ''
             else:
@@ -106,11 +211,44 @@ def process_image_file(file_path: str) -> Tuple[str, str]:
         print(f"Traceback: {traceback.format_exc()}")
         return '', error_msg
 
+_whisper_lock = threading.Lock()
+WHISPER_MODEL_NAME = os.getenv('WHISPER_MODEL', 'small')
+
+
+@functools.lru_cache(maxsize=1)
+def _whisper_device() -> str:
+    """'cuda' nếu có GPU (torch là dependency của whisper), ngược lại 'cpu'"""
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+@functools.lru_cache(maxsize=2)
+def _load_whisper_model(name: str):
+    return whisper.load_model(name, device=_whisper_device())
+
+
+def _get_whisper_model(name: str = WHISPER_MODEL_NAME):
+    """
+    Whisper model load một lần mỗi process rồi dùng lại (load_model tốn vài giây + RAM/VRAM lớn);
+    lock để các request đồng thời lúc khởi động không load trùng
+    """
+    with _whisper_lock:
+        return _load_whisper_model(name)
+
+
+def preload_whisper_model() -> None:
+    """
+    Load Whisper model trước (gọi lúc startup) để request audio đầu tiên không phải chờ load
+    """
+    _get_whisper_model()
+
+
 def process_audio_file(file_path: str) -> str:
     """Transcribe audio thành text bằng Whisper"""
     try:
-        model = whisper.load_model('small')
-        res = model.transcribe(file_path)
+        model = _get_whisper_model()
+        # fp16 chỉ có lợi (và chỉ được hỗ trợ) trên GPU; CPU dùng fp32, không log cảnh báo mỗi lần
+        res = model.transcribe(file_path, fp16=_whisper_device() == 'cuda')
         return res.get('text','')
     except Exception as e:
         return ''
@@ -121,48 +259,88 @@ def process_pdf_file(file_path: str) -> str:
     Hỗ trợ PDF có text layer
     """
     try:
+        if pypdfium2 is not None:
+            return _extract_pdf_text_pdfium(file_path)
+        
         reader = PdfReader(file_path)
+        return '\n'.join(text for text in (page.extract_text() for page in reader.pages) if text)
+    except Exception as e:
+        return ''
+
+
+def _extract_pdf_text_pdfium(file_path: str) -> str:
+    """
+    Extract text bằng pypdfium2, tuần tự từng trang: PDFium không thread-safe
+    nên không chia trang ra thread pool
+    """
+    pdf = pypdfium2.PdfDocument(file_path)
+    try:
         text_parts = []
-        
-        for page in reader.pages:
-            text = page.extract_text()
+        for page in pdf:
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
             if text:
                 text_parts.append(text)
-        
         return '\n'.join(text_parts)
-    except Exception as e:
-        return ''
+    finally:
+        pdf.close()
+
+_W_P = qn('w:p')
+# mc:AlternateContent lưu cùng một text box hai lần: mc:Choice (DrawingML) và mc:Fallback (VML cho Word cũ)
+_MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+# Node trong paragraph mang nội dung text (giống cách python-docx dựng Paragraph.text)
+_DOCX_TEXT_NODES = {
+    qn('w:t'): None,
+    qn('w:tab'): '\t',
+    qn('w:br'): '\n',
+    qn('w:cr'): '\n',
+}
+
+
+def _docx_paragraph_text(p) -> str:
+    parts = []
+    for node in p.iter(*_DOCX_TEXT_NODES):
+        # Node của paragraph lồng bên trong (text box) thuộc về paragraph đó, được lấy ở lượt riêng
+        if next(node.iterancestors(_W_P)) is not p:
+            continue
+        replacement = _DOCX_TEXT_NODES[node.tag]
+        parts.append(node.text or '' if replacement is None else replacement)
+    return ''.join(parts)
+
 
 def process_docx_file(file_path: str) -> str:
     """
     Extract text từ DOCX file
     Hỗ trợ .docx format
+    
+    Duyệt XML body một lần theo thứ tự tài liệu: paragraph nằm trong table
+    cũng được lấy ở cùng lượt, không cần walk riêng doc.tables/cell.text.
+    Text box chỉ lấy một lần (bỏ bản sao trong mc:Fallback).
     """
     try:
         doc = Document(file_path)
         paragraphs = []
         
-        for para in doc.paragraphs:
-            text = para.text.strip()
+        for p in doc.element.body.iter(_W_P):
+            if next(p.iterancestors(_MC_FALLBACK), None) is not None:
+                continue
+            text = _docx_paragraph_text(p).strip()
             if text:
                 paragraphs.append(text)
         
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text = cell.text.strip()
-                    if text:
-                        paragraphs.append(text)
-        
         return '\n'.join(paragraphs)
     except Exception as e:
         return ''
 
 _BULLET_PATTERN = re.compile(r'^\s*[-•●·]\s+', re.MULTILINE)
-_MULTI_SPACE_PATTERN = re.compile(r'\s+')
-_EXTRA_PUNCT_PATTERN = re.compile(r'([!?.,;:]){2,}')
-_SPACE_BEFORE_PUNCT = re.compile(r'\s+([!?.,;:])')
-_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+# Một pass thay cho 3 pass cũ (gộp khoảng trắng, bỏ dấu câu lặp, bỏ khoảng trắng trước dấu câu):
+# - khoảng trắng (nếu có) + chuỗi dấu câu -> chỉ giữ dấu câu cuối, không có khoảng trắng phía trước
+# - khoảng trắng còn lại -> một dấu cách
+_WHITESPACE_PUNCT_PATTERN = re.compile(r'\s*([!?.,;:]+)|\s+')
 
 COMMON_SPELLING_ERRORS = {
     'ko': 'không',
@@ -183,8 +361,31 @@ COMMON_SPELLING_ERRORS = {
     'adress': 'address',
 }
 
+# Các dạng thường / HOA / Title của mỗi key -> replacement đã đúng kiểu chữ (tra một lần, không đổi case từng từ).
+# Title ghi sau UPPER để key một chữ cái ('K') theo luật istitle() như trước -> 'Không'
+_SPELLING_CASE_VARIANTS = {}
+for _key, _value in COMMON_SPELLING_ERRORS.items():
+    _SPELLING_CASE_VARIANTS[_key] = _value
+    _SPELLING_CASE_VARIANTS[_key.upper()] = _value.upper()
+    _SPELLING_CASE_VARIANTS[_key.capitalize()] = _value.capitalize()
+del _key, _value
+
+# Chỉ so khớp nguyên một từ (\w+), giống cách tách token cũ: key có ký tự ngoài \w (vd 'dc.')
+# không bao giờ là một token nên không đưa vào regex
+_SPELL_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(
+        re.escape(key)
+        for key in sorted(COMMON_SPELLING_ERRORS, key=len, reverse=True)
+        if re.fullmatch(r'\w+', key)
+    ) + r')\b',
+    re.IGNORECASE
+)
+
 
 def _normalize_unicode(text: str) -> str:
+    # Text ASCII đã là NFC; isascii() chỉ đọc flag của str -> bỏ qua normalize (và bản copy)
+    if text.isascii():
+        return text
     return unicodedata.normalize('NFC', text)
 
 
@@ -192,38 +393,29 @@ def _standardize_bullets(text: str) -> str:
     return _BULLET_PATTERN.sub(lambda match: f"\n- ", text)
 
 
-def _collapse_whitespace(text: str) -> str:
-    return _MULTI_SPACE_PATTERN.sub(' ', text)
+def _whitespace_punct_repl(match: re.Match) -> str:
+    punct = match.group(1)
+    if punct is None:
+        return ' '
+    return punct[-1]
 
 
-def _fix_repeated_punctuation(text: str) -> str:
-    return _EXTRA_PUNCT_PATTERN.sub(lambda m: m.group(1), text)
+def _normalize_whitespace_and_punct(text: str) -> str:
+    return _WHITESPACE_PUNCT_PATTERN.sub(_whitespace_punct_repl, text)
 
 
-def _trim_space_before_punct(text: str) -> str:
-    return _SPACE_BEFORE_PUNCT.sub(r'\1', text)
+def _spell_correct_repl(match: re.Match) -> str:
+    token = match.group(0)
+    replacement = _SPELLING_CASE_VARIANTS.get(token)
+    if replacement is not None:
+        return replacement
+    # Hoa/thường lẫn lộn (vd 'kO') -> thay bằng dạng thường
+    return COMMON_SPELLING_ERRORS[token.lower()]
 
 
 def _basic_spell_correct(text: str) -> str:
-    tokens = re.split(r'(\W+)', text)
-    corrected: List[str] = []
-    for token in tokens:
-        key = token.lower()
-        if key in COMMON_SPELLING_ERRORS:
-            replacement = COMMON_SPELLING_ERRORS[key]
-            if token.istitle():
-                replacement = replacement.capitalize()
-            elif token.isupper():
-                replacement = replacement.upper()
-            corrected.append(replacement)
-        else:
-            corrected.append(token)
-    return ''.join(corrected)
-
-
-def _normalize_sentence_spacing(text: str) -> str:
-    sentences = [seg.strip() for seg in _SENTENCE_BOUNDARY.split(text) if seg.strip()]
-    return ' '.join(sentences)
+    # Regex chỉ dừng ở các từ cần sửa; phần còn lại của text không bị tách/ghép lại
+    return _SPELL_PATTERN.sub(_spell_correct_repl, text)
 
 
 def clean_text(text: str) -> str:
@@ -237,10 +429,8 @@ def clean_text(text: str) -> str:
     normalized = _normalize_unicode(text)
     normalized = normalized.replace('\r', ' ').strip()
     normalized = _standardize_bullets(normalized)
-    normalized = _collapse_whitespace(normalized)
-    normalized = _fix_repeated_punctuation(normalized)
-    normalized = _trim_space_before_punct(normalized)
+    normalized = _normalize_whitespace_and_punct(normalized)
     normalized = _basic_spell_correct(normalized)
-    normalized = _normalize_sentence_spacing(normalized)
+    # Khoảng trắng đã được gộp thành một dấu cách -> nối câu chỉ còn là strip
     
     return normalized.strip()
@@ -1,5 +1,6 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -8,14 +9,45 @@ DATABASE_URL = os.getenv(
     'postgresql://user:password@db:5432/note_ai'
 )
 
+_DRIVER = make_url(DATABASE_URL).get_driver_name()
+
+
+def _prepare_threshold():
+    """
+    psycopg 3: server-side prepare query sau N lần chạy (DB_PREPARE_THRESHOLD, mặc định 5).
+    'none' tắt hẳn - bắt buộc khi đi qua PgBouncer transaction pooling.
+    """
+    value = os.getenv('DB_PREPARE_THRESHOLD', '5').strip().lower()
+    return None if value == 'none' else int(value)
+
+
+if _DRIVER == 'psycopg2':
+    # psycopg2: UPDATE/DELETE executemany gửi theo batch (execute_batch) thay vì từng dòng;
+    # INSERT nhiều dòng đã dùng insertmanyvalues (VALUES nhiều dòng + RETURNING) của SQLAlchemy 2.x
+    _DRIVER_ARGS = {'executemany_mode': 'values_plus_batch', 'executemany_batch_page_size': 500}
+elif _DRIVER == 'psycopg':
+    # DATABASE_URL dạng postgresql+psycopg:// (hoặc postgresql:// với SQLAlchemy 2.1+)
+    _DRIVER_ARGS = {'connect_args': {'prepare_threshold': _prepare_threshold()}}
+else:
+    _DRIVER_ARGS = {}
+
 engine = create_engine(
     DATABASE_URL,
-    pool_pre_ping=True,  
+    # pre-ping giữ mặc định bật: connection bị PgBouncer/failover/idle timeout cắt sẽ được thay
+    # trước khi query đầu tiên lỗi. pool_recycle thay connection cũ định kỳ nên ping hầu như
+    # luôn thành công ngay (tắt bằng DB_POOL_PRE_PING=false nếu DB ổn định và cần bớt round-trip)
+    pool_pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '1800')),
     pool_size=10,
-    max_overflow=20
+    max_overflow=20,
+    # Cache SQL đã compile (mặc định 500) - đủ cho toàn bộ query của app
+    query_cache_size=1200,
+    insertmanyvalues_page_size=1000,
+    **_DRIVER_ARGS
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: không reload lại mọi attribute sau commit (các chỗ cần dữ liệu mới đã refresh() rõ ràng)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
@@ -1,6 +1,10 @@
-from typing import Iterable
+import os
+import re
+import time
+from typing import Iterable, List
 
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 
 from app.database.database import engine, Base
 from app.database import models  
@@ -13,9 +17,26 @@ NOTE_ALTER_STATEMENTS: Iterable[str] = (
     "ALTER TABLE notes ADD COLUMN IF NOT EXISTS mcqs JSONB",
     "ALTER TABLE notes ADD COLUMN IF NOT EXISTS review JSONB",
     "ALTER TABLE notes ADD COLUMN IF NOT EXISTS summary TEXT",
+    # Nén TOAST bằng lz4 (PG14+, chỉ áp dụng cho giá trị ghi mới); server cũ/không build lz4 thì bỏ qua
+    "DO $$ BEGIN "
+    "ALTER TABLE notes ALTER COLUMN raw_text SET COMPRESSION lz4, ALTER COLUMN processed_text SET COMPRESSION lz4; "
+    "EXCEPTION WHEN syntax_error OR feature_not_supported THEN NULL; END $$;",
+    # DB tạo bằng create_all cũ có các cột này kiểu JSON (text) -> chuyển sang JSONB như model hiện tại.
+    # Chỉ ALTER khi còn là json: ALTER ... USING trên cột đã là jsonb vẫn rewrite cả bảng.
+    "DO $$ DECLARE col text; BEGIN "
+    "FOR col IN SELECT column_name FROM information_schema.columns "
+    "WHERE table_name = 'notes' AND column_name IN ('summaries', 'questions', 'mcqs', 'review') AND data_type = 'json' "
+    "LOOP EXECUTE 'ALTER TABLE notes ALTER COLUMN ' || quote_ident(col) || ' TYPE JSONB USING ' || quote_ident(col) || '::jsonb'; "
+    "END LOOP; END $$;",
     "DROP INDEX IF EXISTS ix_notes_note_id",
-    "DO $ BEGIN IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ix_notes_note_id') THEN ALTER TABLE notes DROP CONSTRAINT ix_notes_note_id; END IF; END $;",
+    "DO $$ BEGIN IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ix_notes_note_id') THEN ALTER TABLE notes DROP CONSTRAINT ix_notes_note_id; END IF; END $$;",
     "CREATE UNIQUE INDEX IF NOT EXISTS uq_notes_user_note_id ON notes (user_id, note_id)",
+    # Cache key của kết quả AI: tách khỏi review JSON để check cache bằng filter SQL
+    "ALTER TABLE notes ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE notes ADD COLUMN IF NOT EXISTS ai_schema_version SMALLINT",
+    "UPDATE notes SET content_hash = review->>'content_hash', "
+    "ai_schema_version = CASE WHEN review->>'ai_schema_version' ~ '^[0-9]+$' THEN (review->>'ai_schema_version')::smallint END "
+    "WHERE content_hash IS NULL AND review->>'content_hash' IS NOT NULL",
 )
 
 USER_ALTER_STATEMENTS: Iterable[str] = (
@@ -26,8 +47,12 @@ USER_ALTER_STATEMENTS: Iterable[str] = (
     "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT FALSE",
     
     # Account type and limits
-    "DO $$ BEGIN CREATE TYPE accounttype AS ENUM ('FREE', 'PRO', 'ENTERPRISE'); EXCEPTION WHEN duplicate_object THEN null; END $$;",
     "ALTER TABLE users ADD COLUMN IF NOT EXISTS account_type VARCHAR(20) DEFAULT 'FREE'",
+    # DB tạo bằng create_all cũ dùng ENUM accounttype -> VARCHAR + CHECK (khớp models.User.account_type)
+    "DO $$ BEGIN IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'users' AND column_name = 'account_type' AND udt_name = 'accounttype') "
+    "THEN ALTER TABLE users ALTER COLUMN account_type TYPE VARCHAR(20) USING account_type::text; END IF; END $$;",
+    "DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ck_users_account_type') "
+    "THEN ALTER TABLE users ADD CONSTRAINT ck_users_account_type CHECK (account_type IN ('FREE', 'PRO', 'ENTERPRISE')); END IF; END $$;",
     "ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_note_limit INTEGER DEFAULT 3",
     "UPDATE users SET daily_note_limit = 3 WHERE account_type = 'FREE' AND daily_note_limit = 5",
     "ALTER TABLE users ADD COLUMN IF NOT EXISTS notes_created_today INTEGER DEFAULT 0",
@@ -40,8 +65,48 @@ USER_ALTER_STATEMENTS: Iterable[str] = (
     # Indexes for performance
     "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email) WHERE email IS NOT NULL",
     "CREATE INDEX IF NOT EXISTS ix_users_account_type ON users (account_type)",
+    # Quét user Pro theo hạn subscription (partial index: chỉ chứa user Pro)
+    "CREATE INDEX IF NOT EXISTS ix_users_pro_subscription_end ON users (subscription_end) WHERE account_type = 'PRO'",
 )
 
+# Timestamp do Postgres điền (models dùng server_default), UTC giống datetime.utcnow cũ
+TIMESTAMP_DEFAULT_STATEMENTS: Iterable[str] = tuple(
+    f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT timezone('utc', now())"
+    for table, columns in (
+        ('users', ('created_at', 'updated_at', 'last_reset_date')),
+        ('notes', ('created_at', 'updated_at')),
+        ('feedbacks', ('created_at', 'updated_at')),
+        ('payments', ('created_at', 'updated_at')),
+    )
+    for column in columns
+)
+
+# CREATE INDEX CONCURRENTLY không chạy được trong transaction -> chạy riêng ở chế độ AUTOCOMMIT
+INDEX_STATEMENTS: Iterable[str] = (
+    # History list: WHERE user_id [AND file_type] ORDER BY created_at DESC (covering index, PG12+)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_user_type_created ON notes (user_id, file_type, created_at DESC) INCLUDE (note_id, filename)",
+    # Full-text search cho search_notes (phải khớp biểu thức trong db_service.search_notes)
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_search_tsv ON notes USING GIN (to_tsvector('simple', coalesce(summary, '') || ' ' || coalesce(processed_text, '')))",
+    # Feedbacks của một note, mới nhất trước
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_feedbacks_note_created ON feedbacks (note_id, created_at DESC)",
+    # Cache check của /process: (user_id, note_id) + content_hash + schema version
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notes_user_note_fresh ON notes (user_id, note_id, content_hash, ai_schema_version)",
+    # History list không lọc file_type (covering index) -> index đơn cột user_id/created_at thừa, bỏ để giảm chi phí ghi
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notes_user_created ON notes (user_id, created_at DESC) INCLUDE (note_id, filename, file_type, file_size, job_id)",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_user_id",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_created_at",
+    # Tra note theo job_id của Celery: chỉ index các dòng có job_id
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notes_job_id_active ON notes (job_id) WHERE job_id IS NOT NULL",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_job_id",
+    # Kết quả AI được ghi lại mỗi lần chạy AI và không có query @> nào -> GIN chỉ tốn chi phí ghi
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_summaries_gin",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_questions_gin",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_mcqs_gin",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_notes_review_gin",
+)
+
+_CREATE_INDEX_NAME = re.compile(r"CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS (\w+)")
+
 PAYMENT_TABLE_CREATION = """
 CREATE TABLE IF NOT EXISTS payments (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -64,34 +129,96 @@ CREATE INDEX IF NOT EXISTS ix_payments_status ON payments (payment_status);
 """
 
 
+def _run_batched(conn, statements: List[str]) -> None:
+    """
+    Gửi toàn bộ statements (đều idempotent) trong một round-trip.
+    Nếu batch lỗi thì chạy lại từng statement, mỗi statement trong một SAVEPOINT
+    để một statement lỗi không làm hỏng cả transaction.
+    """
+    try:
+        with conn.begin_nested():
+            conn.exec_driver_sql(";\n".join(s.strip().rstrip(";") for s in statements))
+        return
+    except Exception as e:
+        print(f"Warning: Batched migration failed, retrying statement by statement: {e}")
+    
+    for statement in statements:
+        try:
+            with conn.begin_nested():
+                conn.exec_driver_sql(statement)
+        except Exception as e:
+            print(f"Warning: Migration statement failed: {e}")
+
+
+def _drop_invalid_indexes(conn, statements: Iterable[str]) -> None:
+    """
+    CREATE INDEX CONCURRENTLY bị lỗi giữa chừng để lại index INVALID cùng tên;
+    IF NOT EXISTS sẽ bỏ qua nó mãi mãi -> drop trước để lần chạy này build lại.
+    """
+    names = [match.group(1) for match in map(_CREATE_INDEX_NAME.match, statements) if match]
+    if not names:
+        return
+    try:
+        invalid = conn.execute(
+            text(
+                "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+            ),
+            {"names": names}
+        ).scalars().all()
+    except Exception as e:
+        print(f"Warning: Invalid index check failed: {e}")
+        return
+    
+    for name in invalid:
+        print(f"Dropping invalid index {name} (left by a failed concurrent build)")
+        try:
+            conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+        except Exception as e:
+            print(f"Warning: Dropping invalid index {name} failed: {e}")
+
+
+# Container chạy migrations trước uvicorn có thể khởi động trước khi Postgres nhận kết nối
+_DB_CONNECT_ATTEMPTS = int(os.getenv('DB_CONNECT_ATTEMPTS', '30'))
+_DB_CONNECT_RETRY_SECONDS = 2.0
+
+
+def _wait_for_db() -> None:
+    """
+    Thử kết nối DB tới khi thành công; hết số lần thử thì raise lỗi kết nối cuối cùng
+    """
+    for attempt in range(1, _DB_CONNECT_ATTEMPTS + 1):
+        try:
+            with engine.connect():
+                return
+        except OperationalError as e:
+            if attempt == _DB_CONNECT_ATTEMPTS:
+                raise
+            print(f"Database not ready ({attempt}/{_DB_CONNECT_ATTEMPTS}), retrying: {e}")
+            time.sleep(_DB_CONNECT_RETRY_SECONDS)
+
+
 def run_migrations() -> None:
     """
     Idempotent schema updates to keep legacy databases in sync
     with the current SQLAlchemy models.
     """
+    _wait_for_db()
+    
     # Create all tables from models
     Base.metadata.create_all(bind=engine)
     
+    statements = [*NOTE_ALTER_STATEMENTS, *USER_ALTER_STATEMENTS, PAYMENT_TABLE_CREATION, *TIMESTAMP_DEFAULT_STATEMENTS]
     with engine.begin() as conn:
-        # Run note migrations
-        for statement in NOTE_ALTER_STATEMENTS:
-            try:
-                conn.execute(text(statement))
-            except Exception as e:
-                print(f"Warning: Migration statement failed: {e}")
-        
-        # Run user migrations
-        for statement in USER_ALTER_STATEMENTS:
+        _run_batched(conn, statements)
+    
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _drop_invalid_indexes(conn, INDEX_STATEMENTS)
+        for statement in INDEX_STATEMENTS:
             try:
                 conn.execute(text(statement))
             except Exception as e:
-                print(f"Warning: User migration statement failed: {e}")
-        
-        # Create payments table
-        try:
-            conn.execute(text(PAYMENT_TABLE_CREATION))
-        except Exception as e:
-            print(f"Warning: Payment table creation failed: {e}")
+                print(f"Warning: Index creation failed: {e}")
     
     print("✅ Migrations complete (users, notes, payments, feedbacks schema up-to-date).")
 
@@ -1,14 +1,44 @@
-from datetime import datetime
+import os
+import time
 import uuid
 from enum import Enum
 
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Integer, JSON, UniqueConstraint, Boolean, Enum as SQLEnum
-from sqlalchemy.dialects.postgresql import UUID as PGUUID
-from sqlalchemy.orm import relationship
+import orjson
+
+from sqlalchemy import func, text, Column, String, Text, DateTime, ForeignKey, Integer, SmallInteger, JSON, UniqueConstraint, Boolean, Index, desc, Enum as SQLEnum
+from sqlalchemy.dialects.postgresql import JSONB, UUID as PGUUID
+from sqlalchemy.orm import deferred, relationship
 
 from app.database.database import Base
 
 
+def _utc_now():
+    """
+    Timestamp UTC (naive, giống datetime.utcnow cũ) do Postgres tính:
+    không phải bind thêm tham số Python cho mỗi INSERT/UPDATE
+    """
+    return func.timezone('utc', func.now())
+
+
+def _uuid7() -> uuid.UUID:
+    """
+    UUIDv7 (RFC 9562): 48 bit timestamp (ms) đứng đầu, phần còn lại random.
+    Id mới tăng dần theo thời gian -> INSERT chèn vào cuối B-tree của PK/FK thay vì trang ngẫu nhiên,
+    nhưng vẫn là UUID như cũ (id đã lộ ra API nên không đổi sang BIGINT được)
+    """
+    rand = int.from_bytes(os.urandom(10), 'big')
+    value = (time.time_ns() // 1_000_000) << 80
+    value |= 0x7 << 76                      # version 7
+    value |= ((rand >> 62) & 0xFFF) << 64   # rand_a (12 bit)
+    value |= 0b10 << 62                     # variant RFC 4122/9562
+    value |= rand & ((1 << 62) - 1)         # rand_b (62 bit)
+    return uuid.UUID(int=value)
+
+
+# Đọc lại server default/onupdate bằng RETURNING trong cùng câu INSERT/UPDATE thay vì SELECT riêng
+_MAPPER_ARGS = {'eager_defaults': True}
+
+
 class AccountType(str, Enum):
     """Loại tài khoản"""
     FREE = "free"
@@ -21,6 +51,7 @@ class User(Base):
     User Model - Lưu thông tin người dùng
     """
     __tablename__ = 'users'
+    __mapper_args__ = _MAPPER_ARGS
     
     id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     username = Column(String(100), unique=True, nullable=False, index=True)
@@ -32,24 +63,30 @@ class User(Base):
     is_verified = Column(Boolean, default=False, nullable=False)
     
     # Account Type & Limits
-    account_type = Column(SQLEnum(AccountType), default=AccountType.FREE, nullable=False)
+    # VARCHAR + CHECK thay cho Postgres ENUM (thêm loại mới không cần ALTER TYPE); vẫn lưu tên enum ('FREE', ...) như cũ
+    account_type = Column(
+        SQLEnum(AccountType, native_enum=False, length=20, create_constraint=True, name='ck_users_account_type'),
+        default=AccountType.FREE,
+        nullable=False
+    )
     daily_note_limit = Column(Integer, default=3, nullable=False)  # Free: 3 notes/day (Gemini limit), Pro: unlimited (-1)
     notes_created_today = Column(Integer, default=0, nullable=False)
-    last_reset_date = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_reset_date = Column(DateTime, server_default=_utc_now(), nullable=False)
     
     # Subscription (for Pro users)
     subscription_start = Column(DateTime, nullable=True)
     subscription_end = Column(DateTime, nullable=True)
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=_utc_now(), nullable=False)
+    updated_at = Column(DateTime, server_default=_utc_now(), onupdate=_utc_now())
     last_login = Column(DateTime, nullable=True)
     
     # Relationships
-    notes = relationship("Note", back_populates="user", cascade="all, delete-orphan")
-    feedbacks = relationship("Feedback", back_populates="user", cascade="all, delete-orphan")
-    payments = relationship("Payment", back_populates="user", cascade="all, delete-orphan")
+    # lazy="raise": không lazy-load ngầm (tránh N+1); query nào cần thì tự .options(selectinload(...))
+    notes = relationship("Note", back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    feedbacks = relationship("Feedback", back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    payments = relationship("Payment", back_populates="user", cascade="all, delete-orphan", lazy="raise")
     
     def __repr__(self):
         return f"<User(id={self.id}, username={self.username}, account_type={self.account_type})>"
@@ -75,8 +112,9 @@ class Payment(Base):
     Payment Model - Lưu lịch sử thanh toán
     """
     __tablename__ = 'payments'
+    __mapper_args__ = _MAPPER_ARGS
     
-    id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(PGUUID(as_uuid=True), primary_key=True, default=_uuid7)
     user_id = Column(PGUUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
     
     # Payment info
@@ -95,11 +133,11 @@ class Payment(Base):
     
     # Metadata
     payment_data = Column(JSON, nullable=True)  # Lưu response từ payment gateway
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=_utc_now(), nullable=False, index=True)
+    updated_at = Column(DateTime, server_default=_utc_now(), onupdate=_utc_now())
     
     # Relationship
-    user = relationship("User", back_populates="payments")
+    user = relationship("User", back_populates="payments", lazy="raise")
     
     def __repr__(self):
         return f"<Payment(id={self.id}, user_id={self.user_id}, amount={self.amount}, status={self.status})>"
@@ -125,12 +163,28 @@ class Note(Base):
     Note Model - Lưu metadata và kết quả xử lý AI
     """
     __tablename__ = 'notes'
+    __mapper_args__ = _MAPPER_ARGS
     __table_args__ = (
         UniqueConstraint('user_id', 'note_id', name='uq_notes_user_note_id'),
+        Index(
+            'idx_notes_user_type_created',
+            'user_id', 'file_type', desc('created_at'),
+            postgresql_include=['note_id', 'filename'],
+        ),
+        Index('idx_notes_user_note_fresh', 'user_id', 'note_id', 'content_hash', 'ai_schema_version'),
+        # History list không lọc file_type: index-only scan theo (user_id, created_at DESC);
+        # thay cho index đơn cột user_id / created_at
+        Index(
+            'ix_notes_user_created',
+            'user_id', desc('created_at'),
+            postgresql_include=['note_id', 'filename', 'file_type', 'file_size', 'job_id'],
+        ),
+        # Chỉ note có job_id mới được tra theo job_id -> partial index
+        Index('ix_notes_job_id_active', 'job_id', postgresql_where=text('job_id IS NOT NULL')),
     )
     
-    id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(PGUUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
+    id = Column(PGUUID(as_uuid=True), primary_key=True, default=_uuid7)
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey('users.id'), nullable=False)
     
     # Metadata
     note_id = Column(String(100), nullable=False, index=True)  
@@ -139,27 +193,33 @@ class Note(Base):
     file_size = Column(Integer, nullable=True)  
     
     # Processed content
-    raw_text = Column(Text, nullable=True)  
-    processed_text = Column(Text, nullable=True)  
+    # Text lớn: không load cùng Note mặc định; query nào cần thì .options(undefer_group('content'))
+    raw_text = deferred(Column(Text, nullable=True), group='content')
+    processed_text = deferred(Column(Text, nullable=True), group='content')
     
     # AI Results
     summary = Column(Text, nullable=True)  
-    summaries = Column(JSON, nullable=True)  
-    questions = Column(JSON, nullable=True)  
-    mcqs = Column(JSON, nullable=True)  
-    review = Column(JSON, nullable=True)  
+    summaries = Column(JSONB, nullable=True)  
+    questions = Column(JSONB, nullable=True)  
+    mcqs = Column(JSONB, nullable=True)  
+    review = Column(JSONB, nullable=True)  
+    
+    # Cache key của kết quả AI (mirror review['content_hash'] / review['ai_schema_version'])
+    content_hash = Column(String(64), nullable=True)
+    ai_schema_version = Column(SmallInteger, nullable=True)
     
     # Job tracking (cho async processing)
-    job_id = Column(String(100), nullable=True, index=True)  
+    job_id = Column(String(100), nullable=True)  
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=_utc_now(), nullable=False)
+    updated_at = Column(DateTime, server_default=_utc_now(), onupdate=_utc_now())
     processed_at = Column(DateTime, nullable=True)  
     
     # Relationship
-    user = relationship("User", back_populates="notes")
-    feedbacks = relationship("Feedback", back_populates="note", cascade="all, delete-orphan")
+    user = relationship("User", back_populates="notes", lazy="raise")
+    # passive_deletes: db.delete(note) không load feedbacks; delete_note xóa chúng bằng một câu DELETE
+    feedbacks = relationship("Feedback", back_populates="note", cascade="all, delete-orphan", lazy="raise", passive_deletes=True)
     
     def __repr__(self):
         return f"<Note(id={self.id}, note_id={self.note_id}, file_type={self.file_type})>"
@@ -187,6 +247,18 @@ class Note(Base):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'processed_at': self.processed_at.isoformat() if self.processed_at else None,
         }
+    
+    _JSON_FIELDS = (
+        'id', 'note_id', 'user_id', 'file_type', 'filename', 'file_size', 'raw_text', 'processed_text',
+        'summary', 'summaries', 'questions', 'mcqs', 'review', 'job_id', 'created_at', 'updated_at', 'processed_at',
+    )
+    
+    def to_json(self) -> bytes:
+        """
+        Giống to_dict() nhưng encode thẳng ra JSON bytes: orjson serialize UUID/datetime bằng C,
+        không cần str()/isoformat() từng field ở Python
+        """
+        return orjson.dumps({field: getattr(self, field) for field in self._JSON_FIELDS})
 
 
 class Feedback(Base):
@@ -194,8 +266,12 @@ class Feedback(Base):
     Feedback Model - Lưu đánh giá của người dùng về tóm tắt
     """
     __tablename__ = 'feedbacks'
+    __mapper_args__ = _MAPPER_ARGS
+    __table_args__ = (
+        Index('idx_feedbacks_note_created', 'note_id', desc('created_at')),
+    )
     
-    id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(PGUUID(as_uuid=True), primary_key=True, default=_uuid7)
     note_id = Column(PGUUID(as_uuid=True), ForeignKey('notes.id'), nullable=False, index=True)
     user_id = Column(PGUUID(as_uuid=True), ForeignKey('users.id'), nullable=False, index=True)
     
@@ -214,12 +290,12 @@ class Feedback(Base):
     suggestions = Column(Text, nullable=True) 
     
     # Metadata
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=_utc_now(), nullable=False, index=True)
+    updated_at = Column(DateTime, server_default=_utc_now(), onupdate=_utc_now())
     
     # Relationships
-    note = relationship("Note", back_populates="feedbacks")
-    user = relationship("User", back_populates="feedbacks")
+    note = relationship("Note", back_populates="feedbacks", lazy="raise")
+    user = relationship("User", back_populates="feedbacks", lazy="raise")
     
     def __repr__(self):
         return f"<Feedback(id={self.id}, note_id={self.note_id}, rating={self.rating})>"
@@ -241,4 +317,15 @@ class Feedback(Base):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
         }
+    
+    _JSON_FIELDS = (
+        'id', 'note_id', 'user_id', 'rating', 'comment', 'feedback_type', 'liked_aspects',
+        'disliked_aspects', 'suggestions', 'created_at', 'updated_at',
+    )
+    
+    def to_json(self) -> bytes:
+        """
+        Giống to_dict() nhưng encode thẳng ra JSON bytes (UUID/datetime serialize bằng orjson)
+        """
+        return orjson.dumps({field: getattr(self, field) for field in self._JSON_FIELDS})
 
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 import os
 import signal
@@ -7,6 +8,9 @@ import sys
 import asyncio
 load_dotenv()
 
+from app.core.logging_config import setup_logging
+setup_logging()
+
 from app.api.v1.router import router as api_router
 from app.api.routes.auth import router as auth_router
 from app.api.routes.payment import router as payment_router
@@ -14,18 +18,26 @@ from app.api.routes.payment import router as payment_router
 app = FastAPI(
     title="NotallyX AI Backend",
     version="2.0.0",
-    description="AI-powered note processing with authentication and subscription management"
+    description="AI-powered note processing with authentication and subscription management",
+    # orjson (Rust) encode response thay cho json stdlib - nhanh hơn nhiều với review/vocab dict lớn
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware configuration
+# Danh sách origin cụ thể (không dùng "*": kết hợp với allow_credentials thì browser từ chối,
+# và Starlette phải echo origin cho mọi request). Dev thêm origin qua CORS_ORIGINS (phân cách bằng dấu phẩy).
+ALLOWED_ORIGINS = tuple(dict.fromkeys(
+    origin.strip()
+    for origin in os.getenv(
+        "CORS_ORIGINS",
+        "http://localhost:3000,http://localhost:8080,https://notallyx.app"
+    ).split(",")
+    if origin.strip() and origin.strip() != "*"
+))
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://localhost:8080",
-        "https://notallyx.app",
-        "*"  # For development - restrict in production
-    ],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -39,16 +51,28 @@ app.include_router(payment_router, prefix="/api/payment", tags=["Payment & Subsc
 @app.on_event("startup")
 async def startup_event():
     """
-    Khởi tạo database khi app start
-    Tạo tables nếu chưa có
+    Warm connection pool khi app start.
+    Schema/migrations chạy một lần trước khi start server (python -m app.database.migrations),
+    không chạy lại DDL ở mỗi worker. DB_INIT_ON_STARTUP=true để tạo tables ngay lúc start (dev).
     """
     try:
-        from app.database.database import init_db
-        init_db()
-        print("✅ Database initialized successfully!")
+        from app.database.database import engine, init_db
+        if os.getenv("DB_INIT_ON_STARTUP", "false").lower() == "true":
+            await asyncio.to_thread(init_db)
+            print("✅ Database initialized successfully!")
+        await asyncio.to_thread(lambda: engine.connect().close())
     except Exception as e:
-        print(f"⚠️  Warning: Database initialization failed: {e}")
+        print(f"⚠️  Warning: Database connection failed: {e}")
         print("Make sure PostgreSQL is running and DATABASE_URL is correct")
+    
+    # Opt-in: chỉ bật cho process thực sự xử lý audio (model chiếm vài trăm MB RAM/VRAM)
+    if os.getenv("WHISPER_PRELOAD", "false").lower() == "true":
+        try:
+            from app.core.preprocessor import preload_whisper_model
+            await asyncio.to_thread(preload_whisper_model)
+            print("✅ Whisper model preloaded")
+        except Exception as e:
+            print(f"⚠️  Warning: Whisper preload failed: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -57,7 +81,8 @@ async def shutdown_event():
     """
     print("🛑 Shutting down server...")
     try:
-        pass
+        from app.payment.casso import close_http_clients
+        await close_http_clients()
     except Exception as e:
         print(f"⚠️  Warning during shutdown: {e}")
     print("✅ Server shutdown complete")
@@ -3,13 +3,21 @@ CASSO payment integration for Vietnamese users
 CASSO provides automatic bank transfer detection with QR code
 Easier and faster for users - no redirect needed
 """
+import asyncio
 import os
+import re
+import time
 import hmac
 import hashlib
+import httpx
 import requests
-from typing import Dict, Optional, List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Mapping, Optional, List, Set, Tuple, Union
 from datetime import datetime, timedelta
+import urllib.parse
 import uuid
+from types import MappingProxyType
 
 
 class CassoConfig:
@@ -25,6 +33,146 @@ class CassoConfig:
     BANK_ACCOUNT_NAME = os.getenv("BANK_ACCOUNT_NAME", "CONG TY NOTALLYX")
 
 
+# Tên ngân hàng / viết tắt -> mã ngân hàng VietQR
+_BANK_CODES: Dict[str, str] = {
+    "Vietcombank": "VCB",
+    "VCB": "VCB",
+    "Techcombank": "TCB",
+    "TCB": "TCB",
+    "BIDV": "BIDV",
+    "VietinBank": "CTG",
+    "CTG": "CTG",
+    "Agribank": "AGR",
+    "AGR": "AGR",
+    "MB": "MB",
+    "MBBank": "MB",
+    "ACB": "ACB",
+    "VPBank": "VPB",
+    "VPB": "VPB",
+    "TPBank": "TPB",
+    "TPB": "TPB",
+    "Sacombank": "STB",
+    "STB": "STB",
+    "HDBank": "HDB",
+    "HDB": "HDB",
+    "VIB": "VIB",
+    "SHB": "SHB",
+    "Eximbank": "EIB",
+    "EIB": "EIB",
+    "MSB": "MSB",
+    "OCB": "OCB",
+    "SeABank": "SEAB",
+    "SEAB": "SEAB"
+}
+
+# VietQR: https://img.vietqr.io/image/{BANK_CODE}-{ACCOUNT_NUMBER}-{TEMPLATE}.png?amount={AMOUNT}&addInfo={DESCRIPTION}
+# Template ảnh: compact (nhỏ gọn), compact2 (có logo), print (in ấn).
+# Tên chủ tài khoản là config cố định -> encode sẵn một lần; mỗi payment chỉ format amount/nội dung
+_VIETQR_URL_TEMPLATE = (
+    "https://img.vietqr.io/image/{bank_code}-{bank_account}-compact2.png"
+    "?amount={amount}&addInfo={description}&accountName="
+    + urllib.parse.quote(CassoConfig.BANK_ACCOUNT_NAME)
+)
+
+# HMAC-SHA256 đã nạp sẵn key (inner/outer state tính một lần); mỗi webhook chỉ copy() rồi update payload
+_WEBHOOK_HMAC = hmac.new(CassoConfig.WEBHOOK_SECRET.encode('utf-8'), digestmod=hashlib.sha256)
+
+# Nội dung chuyển khoản "NOTALLYX <order_id>" (ngân hàng có thể thêm text trước/sau, đổi hoa/thường)
+_ORDER_ID_PATTERN = re.compile(r"NOTALLYX\s*(\S+)", re.IGNORECASE)
+
+# (connect, read) timeout cho CASSO API
+_HTTP_TIMEOUT = (3, 10)
+
+# TransactionBatcher: thời gian gom các lần verify trước khi gọi API,
+# và thời gian dùng lại danh sách transactions vừa fetch cho các batch sau
+_BATCH_WINDOW_SECONDS = 0.5
+_BATCH_INDEX_TTL_SECONDS = 5.0
+
+
+def _build_http_session() -> requests.Session:
+    """
+    Session dùng chung cho mọi CassoService: giữ kết nối keep-alive trong pool,
+    không phải bắt tay TCP/TLS lại ở mỗi lần gọi API
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=frozenset({"GET"}))
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_http_session = _build_http_session()
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """AsyncClient dùng chung (tạo lần đầu khi cần) cho các API async"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(_HTTP_TIMEOUT[1], connect=_HTTP_TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            transport=httpx.AsyncHTTPTransport(retries=3)
+        )
+    return _async_client
+
+
+async def close_http_clients() -> None:
+    """Đóng các connection pool (gọi khi app shutdown)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    _http_session.close()
+
+
+class TransactionIndex:
+    """
+    Transactions từ CASSO đã chuẩn hóa (nội dung upper-case một lần cho mỗi transaction)
+    để tra nhiều order: khớp chính xác (nội dung, amount) bằng dict, không thì quét tìm chuỗi con
+    """
+    
+    __slots__ = ("_rows", "_exact")
+    
+    def __init__(self, transactions: List[Dict]):
+        self._rows: List[Tuple[str, int, Dict]] = []
+        self._exact: Dict[Tuple[str, int], Dict] = {}
+        for txn in transactions:
+            description = (txn.get("description") or "").strip().upper()
+            amount = int(txn.get("amount", 0))
+            self._rows.append((description, amount, txn))
+            # Giữ transaction đầu tiên nếu trùng (cùng thứ tự ưu tiên với cách quét cũ)
+            self._exact.setdefault((description, amount), txn)
+    
+    def find(self, order_id: str, expected_amount: int) -> Optional[Dict]:
+        """
+        Transaction data (đã verify) của order, None nếu không có
+        """
+        transfer_content = f"NOTALLYX {order_id}".upper()
+        txn = self._exact.get((transfer_content, expected_amount))
+        if txn is None:
+            # Ngân hàng thường thêm prefix/suffix vào nội dung chuyển khoản -> tìm chuỗi con
+            for description, amount, candidate in self._rows:
+                if amount == expected_amount and transfer_content in description:
+                    txn = candidate
+                    break
+        if txn is None:
+            return None
+        
+        return {
+            "transaction_id": txn.get("id"),
+            "amount": expected_amount,
+            "description": txn.get("description"),
+            "when": txn.get("when"),
+            "bank_sub_acc_id": txn.get("bank_sub_acc_id"),
+            "verified": True
+        }
+
+
 class CassoService:
     """CASSO payment service"""
     
@@ -108,22 +256,14 @@ class CassoService:
         VietQR is the standard QR code format for Vietnamese banks
         Supported by all major banks in Vietnam
         """
-        # VietQR format
-        # https://img.vietqr.io/image/{BANK_CODE}-{ACCOUNT_NUMBER}-{TEMPLATE}.png?amount={AMOUNT}&addInfo={DESCRIPTION}
-        
         # Lấy bank code từ bank name
         bank_code = self._get_bank_code(CassoConfig.BANK_NAME)
         
-        # Encode description for URL
-        import urllib.parse
-        encoded_desc = urllib.parse.quote(description)
-        
-        # Template: compact (nhỏ gọn), compact2 (có logo), print (in ấn)
-        template = "compact2"
-        
-        qr_url = (
-            f"https://img.vietqr.io/image/{bank_code}-{bank_account}-{template}.png"
-            f"?amount={amount}&addInfo={encoded_desc}&accountName={urllib.parse.quote(CassoConfig.BANK_ACCOUNT_NAME)}"
+        qr_url = _VIETQR_URL_TEMPLATE.format(
+            bank_code=bank_code,
+            bank_account=bank_account,
+            amount=amount,
+            description=urllib.parse.quote(description)
         )
         
         # QR data URL for embedding
@@ -137,39 +277,28 @@ class CassoService:
             "bank_code": bank_code
         }
     
-    def _get_bank_code(self, bank_name: str) -> str:
+    @staticmethod
+    def _get_bank_code(bank_name: str) -> str:
         """Get bank code from bank name"""
-        bank_codes = {
-            "Vietcombank": "VCB",
-            "VCB": "VCB",
-            "Techcombank": "TCB",
-            "TCB": "TCB",
-            "BIDV": "BIDV",
-            "VietinBank": "CTG",
-            "CTG": "CTG",
-            "Agribank": "AGR",
-            "AGR": "AGR",
-            "MB": "MB",
-            "MBBank": "MB",
-            "ACB": "ACB",
-            "VPBank": "VPB",
-            "VPB": "VPB",
-            "TPBank": "TPB",
-            "TPB": "TPB",
-            "Sacombank": "STB",
-            "STB": "STB",
-            "HDBank": "HDB",
-            "HDB": "HDB",
-            "VIB": "VIB",
-            "SHB": "SHB",
-            "Eximbank": "EIB",
-            "EIB": "EIB",
-            "MSB": "MSB",
-            "OCB": "OCB",
-            "SeABank": "SEAB",
-            "SEAB": "SEAB"
+        return _BANK_CODES.get(bank_name, "VCB")
+    
+    def _transactions_request(
+        self,
+        from_date: Optional[str],
+        to_date: Optional[str],
+        page: int,
+        page_size: int
+    ) -> tuple:
+        """URL + query params cho API lấy transactions"""
+        params = {
+            "page": page,
+            "pageSize": page_size
         }
-        return bank_codes.get(bank_name, "VCB")
+        if from_date:
+            params["fromDate"] = from_date
+        if to_date:
+            params["toDate"] = to_date
+        return f"{self.base_url}/transactions", params
     
     def get_transactions(
         self,
@@ -191,18 +320,30 @@ class CassoService:
             List of transactions
         """
         try:
-            url = f"{self.base_url}/transactions"
-            params = {
-                "page": page,
-                "pageSize": page_size
-            }
-            
-            if from_date:
-                params["fromDate"] = from_date
-            if to_date:
-                params["toDate"] = to_date
+            url, params = self._transactions_request(from_date, to_date, page, page_size)
+            response = _http_session.get(url, headers=self.headers, params=params, timeout=_HTTP_TIMEOUT)
+            response.raise_for_status()
             
-            response = requests.get(url, headers=self.headers, params=params)
+            data = response.json()
+            return data.get("data", {}).get("records", [])
+        
+        except Exception as e:
+            print(f"Error getting transactions from CASSO: {e}")
+            return []
+    
+    async def aget_transactions(
+        self,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+        page: int = 1,
+        page_size: int = 20
+    ) -> List[Dict]:
+        """
+        Bản async của get_transactions (không block event loop khi gọi từ endpoint async)
+        """
+        try:
+            url, params = self._transactions_request(from_date, to_date, page, page_size)
+            response = await _get_async_client().get(url, headers=self.headers, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -212,6 +353,17 @@ class CassoService:
             print(f"Error getting transactions from CASSO: {e}")
             return []
     
+    @staticmethod
+    def _find_transaction(
+        transactions: List[Dict],
+        order_id: str,
+        expected_amount: int
+    ) -> Optional[Dict]:
+        """
+        Tìm transaction khớp với order_id (nội dung chuyển khoản) và amount
+        """
+        return TransactionIndex(transactions).find(order_id, expected_amount)
+    
     def verify_transaction(
         self,
         order_id: str,
@@ -232,38 +384,31 @@ class CassoService:
         # Tìm kiếm trong transactions gần đây
         from_date = (datetime.now() - timedelta(minutes=time_window_minutes)).strftime("%Y-%m-%d")
         transactions = self.get_transactions(from_date=from_date)
-        
-        # Tìm transaction khớp với order_id và amount
-        transfer_content = f"NOTALLYX {order_id}"
-        
-        for txn in transactions:
-            # Kiểm tra nội dung chuyển khoản
-            description = txn.get("description", "").upper()
-            amount = int(txn.get("amount", 0))
-            
-            # Kiểm tra khớp
-            if transfer_content.upper() in description and amount == expected_amount:
-                return {
-                    "transaction_id": txn.get("id"),
-                    "amount": amount,
-                    "description": txn.get("description"),
-                    "when": txn.get("when"),
-                    "bank_sub_acc_id": txn.get("bank_sub_acc_id"),
-                    "verified": True
-                }
-        
-        return None
+        return self._find_transaction(transactions, order_id, expected_amount)
+    
+    async def averify_transaction(
+        self,
+        order_id: str,
+        expected_amount: int,
+        time_window_minutes: int = 30
+    ) -> Optional[Dict]:
+        """
+        Bản async của verify_transaction
+        """
+        from_date = (datetime.now() - timedelta(minutes=time_window_minutes)).strftime("%Y-%m-%d")
+        transactions = await self.aget_transactions(from_date=from_date)
+        return self._find_transaction(transactions, order_id, expected_amount)
     
     def verify_webhook_signature(
         self,
-        payload: str,
+        payload: Union[str, bytes],
         signature: str
     ) -> bool:
         """
         Verify webhook signature from CASSO
         
         Args:
-            payload: Webhook payload (raw string)
+            payload: Webhook payload (raw body bytes, hoặc string)
             signature: Signature from header
         
         Returns:
@@ -271,11 +416,9 @@ class CassoService:
         """
         try:
             # CASSO uses HMAC-SHA256
-            expected_signature = hmac.new(
-                CassoConfig.WEBHOOK_SECRET.encode('utf-8'),
-                payload.encode('utf-8'),
-                hashlib.sha256
-            ).hexdigest()
+            mac = _WEBHOOK_HMAC.copy()
+            mac.update(payload if isinstance(payload, bytes) else payload.encode('utf-8'))
+            expected_signature = mac.hexdigest()
             
             return hmac.compare_digest(expected_signature, signature)
         
@@ -293,23 +436,49 @@ class CassoService:
         Returns:
             Processed transaction info
         """
-        # Extract transaction info
-        transaction = webhook_data.get("data", {})
+        return self._parse_webhook_transaction(webhook_data.get("data", {}))
+    
+    def process_webhook_batch(self, webhook_data: Dict) -> List[Dict]:
+        """
+        Process webhook chứa một hoặc nhiều transactions
+        (CASSO gửi "data" dạng list khi nhiều giao dịch về cùng lúc; dạng dict đơn vẫn hỗ trợ)
         
-        # Parse order_id from description
-        description = transaction.get("description", "")
-        order_id = None
+        Args:
+            webhook_data: Webhook data from CASSO
         
+        Returns:
+            Processed transaction info, theo thứ tự trong webhook
+        """
+        data = webhook_data.get("data") or []
+        transactions = data if isinstance(data, list) else [data]
+        parsed = []
+        for txn in transactions:
+            try:
+                parsed.append(self._parse_webhook_transaction(txn))
+            except (AttributeError, TypeError, ValueError):
+                # Transaction hỏng không được làm hỏng cả batch
+                parsed.append({"order_id": None, "verified": False})
+        return parsed
+    
+    @staticmethod
+    def _parse_webhook_transaction(transaction: Dict) -> Dict:
+        """
+        Extract transaction info (order_id lấy từ nội dung chuyển khoản)
+        """
+        # Parse order_id from description
         # Format: "NOTALLYX <order_id>"
-        if "NOTALLYX" in description.upper():
-            parts = description.upper().split("NOTALLYX")
-            if len(parts) > 1:
-                order_id = parts[1].strip()
+        description = transaction.get("description") or ""
+        match = _ORDER_ID_PATTERN.search(description)
+        order_id = match.group(1).upper() if match else None
+        
+        amount = transaction.get("amount", 0)
+        if not isinstance(amount, int):
+            amount = int(amount)
         
         return {
             "order_id": order_id,
             "transaction_id": transaction.get("id"),
-            "amount": int(transaction.get("amount", 0)),
+            "amount": amount,
             "description": description,
             "when": transaction.get("when"),
             "bank_sub_acc_id": transaction.get("bank_sub_acc_id"),
@@ -317,8 +486,111 @@ class CassoService:
         }
 
 
+class TransactionBatcher:
+    """
+    Gộp các lần verify transaction đồng thời (nhiều user cùng poll /status) trong một cửa sổ ngắn
+    thành một lần gọi CASSO API, rồi chia kết quả cho từng order đang chờ.
+    Theo từng process (mỗi uvicorn worker một bản), giống RequestCoalescer.
+    """
+    
+    def __init__(
+        self,
+        window_seconds: float = _BATCH_WINDOW_SECONDS,
+        max_pending: int = 50,
+        max_page_size: int = 100,
+        index_ttl_seconds: float = _BATCH_INDEX_TTL_SECONDS
+    ):
+        self._window_seconds = window_seconds
+        self._max_pending = max_pending
+        self._max_page_size = max_page_size
+        self._pending: List[Tuple[str, int, int, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self._service: Optional[CassoService] = None
+        self._index_ttl_seconds = index_ttl_seconds
+        # (thời điểm fetch, from_date, page_size, index) của lần gọi API gần nhất
+        self._index_cache: Optional[Tuple[float, str, int, TransactionIndex]] = None
+    
+    async def verify(
+        self,
+        order_id: str,
+        expected_amount: int,
+        time_window_minutes: int = 30
+    ) -> Optional[Dict]:
+        """
+        Giống CassoService.verify_transaction nhưng dùng chung một lần gọi API với các request cùng cửa sổ
+        
+        Returns:
+            Transaction data if found, None otherwise
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((order_id, expected_amount, time_window_minutes, future))
+        
+        if len(self._pending) >= self._max_pending:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window_seconds, self._start_flush)
+        
+        return await future
+    
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        # Giữ reference tới task cho đến khi chạy xong (tránh bị GC giữa chừng)
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _flush(self, batch: List[Tuple[str, int, int, asyncio.Future]]) -> None:
+        if self._service is None:
+            self._service = CassoService()
+        try:
+            time_window_minutes = max(item[2] for item in batch)
+            from_date = (datetime.now() - timedelta(minutes=time_window_minutes)).strftime("%Y-%m-%d")
+            page_size = min(self._max_page_size, max(20, 2 * len(batch)))
+            index = await self._get_index(from_date, page_size)
+            for order_id, expected_amount, _, future in batch:
+                if not future.done():
+                    future.set_result(index.find(order_id, expected_amount))
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    async def _get_index(self, from_date: str, page_size: int) -> TransactionIndex:
+        """
+        Index transactions của lần fetch gần nhất nếu còn trong TTL (cùng from_date, đủ page_size),
+        ngược lại gọi CASSO API và index lại
+        """
+        cached = self._index_cache
+        now = time.monotonic()
+        if (
+            cached is not None
+            and now - cached[0] < self._index_ttl_seconds
+            and cached[1] == from_date
+            and cached[2] >= page_size
+        ):
+            return cached[3]
+        
+        transactions = await self._service.aget_transactions(from_date=from_date, page_size=page_size)
+        index = TransactionIndex(transactions)
+        self._index_cache = (now, from_date, page_size, index)
+        return index
+
+
+# Global instance
+transaction_batcher = TransactionBatcher()
+
+
 # Pricing plans (same as before)
-PRICING_PLANS = {
+# Read-only (MappingProxyType) để dùng chung một bản cho mọi request.
+# orjson không serialize được mappingproxy -> response phải dựng dict mới (vd. {**plan, ...}).
+_PRICING_PLANS = {
     "pro_1_month": {
         "id": "pro_1_month",
         "name": "Pro - 1 Tháng",
@@ -346,11 +618,17 @@ PRICING_PLANS = {
 }
 
 
-def get_pricing_plan(plan_id: str) -> Optional[Dict]:
-    """Get pricing plan details"""
+PRICING_PLANS: Mapping[str, Mapping] = MappingProxyType({
+    plan_id: MappingProxyType(plan) for plan_id, plan in _PRICING_PLANS.items()
+})
+_ALL_PRICING_PLANS: Tuple[Mapping, ...] = tuple(PRICING_PLANS.values())
+
+
+def get_pricing_plan(plan_id: str) -> Optional[Mapping]:
+    """Get pricing plan details (read-only)"""
     return PRICING_PLANS.get(plan_id)
 
 
-def get_all_pricing_plans() -> List[Dict]:
-    """Get all pricing plans"""
-    return list(PRICING_PLANS.values())
+def get_all_pricing_plans() -> Tuple[Mapping, ...]:
+    """Get all pricing plans (read-only, dùng chung - copy nếu cần sửa)"""
+    return _ALL_PRICING_PLANS
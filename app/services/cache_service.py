@@ -0,0 +1,71 @@
+"""
+Cache Service - In-process cache cho user lookup và kết quả AI của note
+Request lặp lại với cùng nội dung chỉ tốn một query nhẹ (id, updated_at) thay vì load cả note.
+Kết quả note được lưu sẵn dạng JSON bytes để trả thẳng ra response.
+"""
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+
+from cachetools import LRUCache, TTLCache
+
+
+class CacheService:
+    """
+    Cache theo từng process (mỗi uvicorn worker một bản)
+    - users: username -> user UUID string (không bao giờ đổi nên không cần invalidate;
+      account_type luôn đọc từ DB vì worker khác có thể vừa nâng cấp/hạ cấp user)
+    - notes: (note UUID string, updated_at) -> JSON bytes kết quả AI của note
+    - note_views: (note UUID string, updated_at) -> JSON bytes của GET /notes/{note_id}
+    Key chứa updated_at: caller query (id, updated_at) hiện tại từ DB trước khi đọc cache,
+    nên note bị sửa/xóa ở worker khác không bao giờ bị trả ra, không cần TTL/invalidate
+    """
+
+    def __init__(
+        self,
+        user_maxsize: int = 5_000,
+        user_ttl: int = 600,
+        note_maxsize: int = 10_000,
+        note_view_maxsize: int = 10_000
+    ):
+        self._users = TTLCache(maxsize=user_maxsize, ttl=user_ttl)
+        self._notes = LRUCache(maxsize=note_maxsize)
+        self._note_views = LRUCache(maxsize=note_view_maxsize)
+        self._lock = Lock()
+
+    def get_user(self, username: str) -> Optional[str]:
+        """
+        Lấy user UUID string đã cache theo username
+        """
+        with self._lock:
+            return self._users.get(username)
+
+    def set_user(self, username: str, user_id: str) -> None:
+        with self._lock:
+            self._users[username] = user_id
+
+    def get_note_body(self, note_pk: str, updated_at: datetime) -> Optional[bytes]:
+        """
+        Lấy response body (JSON bytes) đã cache của note ứng với đúng phiên bản (updated_at) hiện tại
+        """
+        with self._lock:
+            return self._notes.get((note_pk, updated_at))
+
+    def set_note_body(self, note_pk: str, updated_at: datetime, body: bytes) -> None:
+        with self._lock:
+            self._notes[(note_pk, updated_at)] = body
+
+    def get_note_view(self, note_pk: str, updated_at: datetime) -> Optional[bytes]:
+        """
+        Lấy JSON bytes đã serialize của note ứng với đúng phiên bản (updated_at) hiện tại
+        """
+        with self._lock:
+            return self._note_views.get((note_pk, updated_at))
+
+    def set_note_view(self, note_pk: str, updated_at: datetime, body: bytes) -> None:
+        with self._lock:
+            self._note_views[(note_pk, updated_at)] = body
+
+
+# Global instance
+cache_service = CacheService()
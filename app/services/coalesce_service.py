@@ -0,0 +1,60 @@
+"""
+Coalesce Service - Gộp các request AI giống hệt nhau đang chạy đồng thời
+Request đầu tiên khởi chạy pipeline LLM trong một task, các request trùng key
+đến sau chỉ chờ task đó và nhận bản copy của kết quả.
+"""
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class RequestCoalescer:
+    """
+    Single-flight theo key trong một process (mỗi uvicorn worker một bản)
+    Factory chạy trong task riêng, mọi request chỉ chờ qua asyncio.shield: client của
+    request đầu tiên ngắt kết nối không làm hủy kết quả các request khác đang chờ.
+    Task chỉ bị hủy khi không còn request nào chờ nữa.
+    """
+
+    def __init__(self):
+        # key -> [task, số request đang chờ]
+        self._inflight: Dict[Hashable, list] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Chạy factory() một lần cho mỗi key đang in-flight
+
+        Args:
+            key: Key định danh request (ví dụ content_hash + mode + account_type)
+            factory: Hàm tạo coroutine thực sự xử lý request
+
+        Returns:
+            Kết quả của factory (mỗi request nhận bản riêng để có thể chỉnh sửa tự do)
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(factory())
+            entry = [task, 0]
+            self._inflight[key] = entry
+            task.add_done_callback(lambda _, entry=entry: self._release(key, entry))
+        task = entry[0]
+
+        entry[1] += 1
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                # Mọi request chờ đều đã bị hủy -> không ai cần kết quả nữa
+                task.cancel()
+
+        # Request chờ cuối cùng nhận object gốc, các request trước nó nhận deepcopy
+        return result if entry[1] == 0 else copy.deepcopy(result)
+
+    def _release(self, key: Hashable, entry: list) -> None:
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+
+
+# Global instance
+request_coalescer = RequestCoalescer()
@@ -1,11 +1,27 @@
 """
 Database Service - CRUD operations cho User và Note
 """
-from typing import Optional, List, Dict, Any
-from sqlalchemy.orm import Session
+from typing import Optional, List, Dict, Any, Tuple, Sequence
+from sqlalchemy import select, delete, func, cast, literal_column, Text
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session, undefer_group
 from datetime import datetime
 import uuid
-from app.database.models import User, Note
+from app.database.models import User, Note, Feedback
+
+
+# Các cột (và thứ tự key) giống Note.to_dict() - dùng cho các API trả JSON dựng sẵn từ Postgres
+NOTE_JSON_COLUMNS = (
+    Note.id, Note.note_id, Note.user_id, Note.file_type, Note.filename, Note.file_size,
+    Note.raw_text, Note.processed_text, Note.summary, Note.summaries, Note.questions,
+    Note.mcqs, Note.review, Note.job_id, Note.created_at, Note.updated_at, Note.processed_at,
+)
+
+# Danh sách rút gọn cho màn History (compact=true): bỏ raw_text/processed_text và các cột JSONB lớn
+NOTE_LIST_COLUMNS = (
+    Note.id, Note.note_id, Note.file_type, Note.filename, Note.summary,
+    Note.created_at, Note.updated_at, Note.processed_at,
+)
 
 
 class DatabaseService:
@@ -14,7 +30,12 @@ class DatabaseService:
     """
     
     @staticmethod
-    def get_or_create_user(db: Session, username: str, email: Optional[str] = None) -> User:
+    def get_or_create_user(
+        db: Session,
+        username: str,
+        email: Optional[str] = None,
+        commit: bool = True
+    ) -> User:
         """
         Lấy hoặc tạo user mới
         
@@ -22,6 +43,7 @@ class DatabaseService:
             db: Database session
             username: Username
             email: Email (optional)
+            commit: False -> chỉ flush, caller commit chung transaction với các thay đổi khác
             
         Returns:
             User object
@@ -34,10 +56,25 @@ class DatabaseService:
                 email=email
             )
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            if commit:
+                db.commit()
+                db.refresh(user)
+            else:
+                db.flush()
         return user
     
+    @staticmethod
+    def get_user_account_type(db: Session, user_id: str) -> Optional[str]:
+        """
+        Chỉ lấy account_type của user theo ID (lookup theo primary key, không hydrate User)
+        """
+        account_type = db.execute(
+            select(User.account_type).where(User.id == uuid.UUID(user_id))
+        ).scalar_one_or_none()
+        if account_type is None:
+            return None
+        return account_type.value if hasattr(account_type, 'value') else str(account_type)
+    
     @staticmethod
     def get_user_by_id(db: Session, user_id: str) -> Optional[User]:
         """
@@ -70,6 +107,132 @@ class DatabaseService:
         except:
             return None
 
+    @staticmethod
+    def get_note_if_fresh(
+        db: Session,
+        user_id: str,
+        note_id: str,
+        content_hash: str,
+        schema_version: int
+    ) -> Optional[Note]:
+        """
+        Lấy note chỉ khi kết quả AI đã lưu còn dùng được (content_hash + schema version khớp)
+        Note cũ/khác nội dung bị loại ngay trong SQL, không phải load cột review
+        
+        Args:
+            db: Database session
+            user_id: User ID (UUID string)
+            note_id: Custom note ID từ app
+            content_hash: Hash nội dung của request hiện tại
+            schema_version: AI result schema version hiện tại
+            
+        Returns:
+            Note object hoặc None
+        """
+        try:
+            user_uuid = uuid.UUID(user_id)
+        except ValueError:
+            return None
+        return db.query(Note).options(undefer_group('content')).filter(
+            Note.user_id == user_uuid,
+            Note.note_id == note_id,
+            Note.content_hash == content_hash,
+            Note.ai_schema_version == schema_version,
+            Note.processed_text.isnot(None)
+        ).first()
+
+    @staticmethod
+    def get_note_fresh_version(
+        db: Session,
+        user_id: str,
+        note_id: str,
+        content_hash: str,
+        schema_version: int
+    ) -> Optional[Tuple[uuid.UUID, datetime]]:
+        """
+        Cùng điều kiện với get_note_if_fresh nhưng chỉ lấy (id, updated_at) -
+        dùng làm key đọc cache_service.get_note_body, không load cột text/JSONB
+        
+        Returns:
+            (id, updated_at) hoặc None nếu không có note còn dùng được
+        """
+        try:
+            user_uuid = uuid.UUID(user_id)
+        except ValueError:
+            return None
+        row = db.execute(
+            select(Note.id, Note.updated_at).where(
+                Note.user_id == user_uuid,
+                Note.note_id == note_id,
+                Note.content_hash == content_hash,
+                Note.ai_schema_version == schema_version,
+                Note.processed_text.isnot(None)
+            ).limit(1)
+        ).first()
+        return tuple(row) if row is not None else None
+
+    @staticmethod
+    def _sync_cache_columns(note: Note, review: Optional[Dict[str, Any]]) -> None:
+        """
+        Đồng bộ cột content_hash / ai_schema_version theo review vừa ghi
+        (review không có cache key -> xóa, để note không bị coi là fresh)
+        """
+        if not isinstance(review, dict):
+            review = {}
+        note.content_hash = review.get('content_hash')
+        note.ai_schema_version = review.get('ai_schema_version')
+
+    @staticmethod
+    def get_note_prefer_user(db: Session, note_id: str, user_id: Optional[str] = None) -> Optional[Note]:
+        """
+        Tìm note theo note_id trong một query, ưu tiên note của user_id nếu có
+        (thay cho get_note_by_user_and_note_id rồi fallback get_note_by_note_id)
+        
+        Args:
+            db: Database session
+            note_id: Custom note ID từ app
+            user_id: User ID (UUID) hoặc username (optional)
+            
+        Returns:
+            Note object hoặc None
+        """
+        query = DatabaseService._prefer_user_query(select(Note).options(undefer_group('content')), note_id, user_id)
+        return db.execute(query).scalars().first()
+    
+    @staticmethod
+    def get_note_version_prefer_user(
+        db: Session,
+        note_id: str,
+        user_id: Optional[str] = None
+    ) -> Optional[Tuple[uuid.UUID, Optional[str], Optional[datetime]]]:
+        """
+        Chỉ lấy (id, content_hash, updated_at) của note mà get_note_prefer_user sẽ trả về,
+        không load các cột JSONB/text lớn - dùng để check ETag và cache response
+        
+        Returns:
+            (id, content_hash, updated_at) hoặc None nếu không có note
+        """
+        query = DatabaseService._prefer_user_query(
+            select(Note.id, Note.content_hash, Note.updated_at), note_id, user_id
+        )
+        row = db.execute(query).first()
+        return tuple(row) if row is not None else None
+    
+    @staticmethod
+    def _prefer_user_query(query: Any, note_id: str, user_id: Optional[str]) -> Any:
+        """
+        Lọc theo note_id, sắp xếp để note của user_id (UUID hoặc username) đứng đầu, LIMIT 1
+        """
+        query = query.where(Note.note_id == note_id)
+        if user_id:
+            try:
+                owner = uuid.UUID(user_id)
+            except ValueError:
+                # username -> resolve ngay trong SQL, không tốn thêm round-trip
+                owner = select(User.id).where(User.username == user_id).scalar_subquery()
+            query = query.order_by((Note.user_id == owner).desc().nulls_last())
+        return query.limit(1)
+    
     @staticmethod
     def get_note_by_note_id(db: Session, note_id: str) -> Optional[Note]:
         """
@@ -126,13 +289,13 @@ class DatabaseService:
             existing_note.questions = None
             existing_note.mcqs = None
             existing_note.review = None
+            DatabaseService._sync_cache_columns(existing_note, None)
             existing_note.processed_at = None
             db.commit()
             db.refresh(existing_note)
             return existing_note
 
         note = Note(
-            id=uuid.uuid4(),
             user_id=uuid.UUID(user_id),
             note_id=note_id,
             file_type=file_type,
@@ -164,7 +327,8 @@ class DatabaseService:
         questions: Optional[List[Dict[str, Any]]] = None,
         mcqs: Optional[Dict[str, Any]] = None,
         review: Optional[Dict[str, Any]] = None,
-        job_id: Optional[str] = None
+        job_id: Optional[str] = None,
+        commit: bool = True
     ) -> Note:
         """
         Tạo hoặc cập nhật note (upsert)
@@ -186,6 +350,7 @@ class DatabaseService:
             mcqs: MCQ set
             review: Review từ Reviewer Agent
             job_id: Celery job ID (nếu async)
+            commit: False -> chỉ flush, caller commit chung transaction với các thay đổi khác
             
         Returns:
             Note object (existing hoặc newly created)
@@ -213,17 +378,20 @@ class DatabaseService:
                 existing_note.mcqs = mcqs
             if review is not None:
                 existing_note.review = review
+                DatabaseService._sync_cache_columns(existing_note, review)
             if job_id is not None:
                 existing_note.job_id = job_id
             if processed_text is not None or summary is not None:
                 existing_note.processed_at = datetime.utcnow()
             existing_note.updated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(existing_note)
+            if commit:
+                db.commit()
+                db.refresh(existing_note)
+            else:
+                db.flush()
             return existing_note
         else:
             note = Note(
-                id=uuid.uuid4(),
                 user_id=uuid.UUID(user_id),
                 note_id=note_id,
                 file_type=file_type,
@@ -238,9 +406,13 @@ class DatabaseService:
                 review=review,
                 job_id=job_id
             )
+            DatabaseService._sync_cache_columns(note, review)
             db.add(note)
-            db.commit()
-            db.refresh(note)
+            if commit:
+                db.commit()
+                db.refresh(note)
+            else:
+                db.flush()
             return note
     
     @staticmethod
@@ -302,6 +474,7 @@ class DatabaseService:
             note.mcqs = mcqs
         if review is not None:
             note.review = review
+            DatabaseService._sync_cache_columns(note, review)
         if raw_text is not None:
             note.raw_text = raw_text
         if job_id is not None:
@@ -378,16 +551,107 @@ class DatabaseService:
         
         return query.order_by(desc(Note.created_at)).limit(limit).offset(offset).all()
     
+    @staticmethod
+    def json_array(source: Any, columns: Sequence[Any], order_column: Any) -> Any:
+        """
+        Biểu thức SQL gom các rows của source thành một JSON array (text), key JSON = tên cột
+        
+        Args:
+            source: Subquery/CTE chứa các cột
+            columns: Các cột model cần đưa vào JSON (lấy theo column.key trong source)
+            order_column: Cột của source dùng sắp xếp phần tử (giảm dần)
+        """
+        row_json = func.json_build_object(*[
+            arg for column in columns
+            for arg in (literal_column(f"'{column.key}'"), source.c[column.key])
+        ])
+        # cast sang text để driver trả về chuỗi JSON thô (không parse lại thành dict)
+        return cast(func.coalesce(
+            func.json_agg(aggregate_order_by(row_json, order_column.desc())),
+            literal_column("'[]'::json")
+        ), Text)
+    
+    @staticmethod
+    def json_page(
+        db: Session,
+        columns: Sequence[Any],
+        filters: Sequence[Any],
+        order_column: Any,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[str, int]:
+        """
+        Lấy một trang rows dưới dạng JSON array do Postgres dựng sẵn (json_agg + json_build_object),
+        kèm tổng số rows (COUNT(*) OVER ()) trong cùng một query.
+        Bỏ qua hydrate ORM object + to_dict() + encode JSON lại ở Python.
+        
+        Args:
+            db: Database session
+            columns: Các cột cần trả về (key JSON = tên cột, giống to_dict())
+            filters: Điều kiện WHERE
+            order_column: Cột sắp xếp (giảm dần)
+            limit: Số lượng rows tối đa
+            offset: Offset cho pagination
+            
+        Returns:
+            (JSON array string, total)
+        """
+        page = select(*columns, func.count().over().label('_total')).where(
+            *filters
+        ).order_by(order_column.desc()).limit(limit).offset(offset).subquery('t')
+        
+        rows_json, total = db.execute(
+            select(
+                DatabaseService.json_array(page, columns, page.c[order_column.key]),
+                func.max(page.c._total)
+            )
+        ).one()
+        
+        if total is None:
+            # Trang rỗng: offset vượt quá số rows (hoặc không có rows) -> vẫn cần total đúng
+            total = db.execute(select(func.count()).select_from(columns[0].class_).where(*filters)).scalar() if offset else 0
+        return rows_json, total
+    
+    @staticmethod
+    def get_user_notes_json(
+        db: Session,
+        user_uuid: uuid.UUID,
+        limit: int = 50,
+        offset: int = 0,
+        file_type: Optional[str] = None,
+        compact: bool = False
+    ) -> Tuple[str, int]:
+        """
+        Lấy một trang notes của user (History) dạng JSON array kèm tổng số notes
+        
+        Args:
+            db: Database session
+            user_uuid: User UUID
+            limit: Số lượng notes tối đa
+            offset: Offset cho pagination
+            file_type: Lọc theo loại file (optional)
+            compact: True -> chỉ lấy NOTE_LIST_COLUMNS (không đọc text/JSONB lớn)
+            
+        Returns:
+            (JSON array string, total)
+        """
+        filters = [Note.user_id == user_uuid]
+        if file_type:
+            filters.append(Note.file_type == file_type)
+        columns = NOTE_LIST_COLUMNS if compact else NOTE_JSON_COLUMNS
+        return DatabaseService.json_page(db, columns, filters, Note.created_at, limit, offset)
+    
     @staticmethod
     def search_notes(
         db: Session,
         user_id: str,
         query_text: str,
         limit: int = 50,
-        offset: int = 0
-    ) -> List[Note]:
+        offset: int = 0,
+        compact: bool = False
+    ) -> Tuple[str, int]:
         """
-        Tìm kiếm notes theo text (search trong summary, raw_text, processed_text)
+        Tìm kiếm notes theo text (full-text search trong summary và processed_text)
         
         Args:
             db: Database session
@@ -395,31 +659,30 @@ class DatabaseService:
             query_text: Text để tìm kiếm
             limit: Số lượng kết quả tối đa
             offset: Offset cho pagination
+            compact: True -> chỉ lấy NOTE_LIST_COLUMNS (không đọc text/JSONB lớn)
             
         Returns:
-            List of Note objects
+            (JSON array string của notes, tổng số notes khớp)
         """
-        from app.database.models import Note
-        from sqlalchemy import desc, or_
-        
         try:
             user_uuid = uuid.UUID(user_id)
         except ValueError:
-            user = db.query(User).filter(User.username == user_id).first()
-            if not user:
-                return []  
-            user_uuid = user.id
+            user_uuid = db.execute(select(User.id).where(User.username == user_id)).scalar()
+            if not user_uuid:
+                return "[]", 0
         
-        search_pattern = f"%{query_text}%"
+        # Biểu thức phải khớp với GIN index idx_notes_search_tsv (xem migrations.py)
+        search_vector = func.to_tsvector(
+            'simple',
+            func.coalesce(Note.summary, '') + ' ' + func.coalesce(Note.processed_text, '')
+        )
         
-        return db.query(Note).filter(
+        filters = [
             Note.user_id == user_uuid,
-            or_(
-                Note.summary.ilike(search_pattern),
-                Note.raw_text.ilike(search_pattern),
-                Note.processed_text.ilike(search_pattern)
-            )
-        ).order_by(desc(Note.created_at)).limit(limit).offset(offset).all()
+            search_vector.op('@@')(func.plainto_tsquery('simple', query_text))
+        ]
+        columns = NOTE_LIST_COLUMNS if compact else NOTE_JSON_COLUMNS
+        return DatabaseService.json_page(db, columns, filters, Note.created_at, limit, offset)
     
     @staticmethod
     def delete_note(db: Session, note_id: str) -> bool:
@@ -437,6 +700,7 @@ class DatabaseService:
         if not note:
             return False
         
+        db.execute(delete(Feedback).where(Feedback.note_id == note.id))
         db.delete(note)
         db.commit()
         return True
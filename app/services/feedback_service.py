@@ -1,15 +1,28 @@
 """
 Feedback Service - Quản lý feedback và RAG cho prompt improvement
 """
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Sequence, Iterator
 from sqlalchemy.exc import OperationalError, InterfaceError
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func, and_
+from sqlalchemy import desc, func, and_, or_, select
 from datetime import datetime
 import uuid
 from app.database.models import Feedback, Note, User
 
 
+# Các cột (và thứ tự key) giống Feedback.to_dict() - dùng cho các API trả JSON dựng sẵn từ Postgres
+FEEDBACK_JSON_COLUMNS = (
+    Feedback.id, Feedback.note_id, Feedback.user_id, Feedback.rating, Feedback.comment,
+    Feedback.feedback_type, Feedback.liked_aspects, Feedback.disliked_aspects,
+    Feedback.suggestions, Feedback.created_at, Feedback.updated_at,
+)
+
+_RATINGS = (1, 2, 3, 4, 5)
+_FEEDBACK_TYPES = ('positive', 'negative', 'neutral')
+# 200 ký tự đầu của raw_text, cắt trong SQL (không kéo cả cột text lớn về)
+_RAW_TEXT_PREVIEW = func.nullif(func.left(Note.raw_text, 200), '').label('raw_text_preview')
+
+
 class FeedbackService:
     """
     Service để quản lý feedback và cải thiện prompts
@@ -66,7 +79,6 @@ class FeedbackService:
                 feedback_type = 'neutral'
         
         feedback = Feedback(
-            id=uuid.uuid4(),
             note_id=note.id,
             user_id=user.id,
             rating=rating,
@@ -94,16 +106,134 @@ class FeedbackService:
             return None
     
     @staticmethod
-    def get_feedbacks_by_note(db: Session, note_id: str) -> List[Feedback]:
+    def get_feedbacks_by_note(
+        db: Session,
+        note_id: str,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> List[Feedback]:
         """
-        Lấy tất cả feedbacks của một note
+        Lấy feedbacks của một note (mới nhất trước)
+        
+        Args:
+            note_id: Note ID (custom note_id hoặc UUID)
+            limit: Số lượng feedbacks tối đa (None = lấy tất cả, dùng cho export)
+            offset: Offset cho pagination
         """
         from app.services.db_service import db_service
         note = db_service.get_note_by_id(db, note_id)
         if not note:
             return []
         
-        return db.query(Feedback).filter(Feedback.note_id == note.id).order_by(desc(Feedback.created_at)).all()
+        query = db.query(Feedback).filter(Feedback.note_id == note.id).order_by(desc(Feedback.created_at))
+        if limit is not None:
+            query = query.limit(limit).offset(offset)
+        return query.all()
+    
+    @staticmethod
+    def iter_feedbacks_by_note(db: Session, note_id: str, chunk_size: int = 500) -> Iterator[Feedback]:
+        """
+        Stream toàn bộ feedbacks của một note (mới nhất trước) cho export
+        yield_per -> server-side cursor, mỗi lần chỉ fetch chunk_size dòng (bộ nhớ không phụ thuộc số feedback)
+        
+        Args:
+            note_id: Note ID (custom note_id hoặc UUID)
+            chunk_size: Số dòng mỗi lần fetch
+        """
+        stmt = (
+            select(Feedback)
+            .where(Feedback.note_id == FeedbackService._note_pk_subquery(note_id))
+            .order_by(desc(Feedback.created_at))
+            .execution_options(yield_per=chunk_size)
+        )
+        yield from db.execute(stmt).scalars()
+    
+    @staticmethod
+    def _note_pk_subquery(note_id: str):
+        """
+        Subquery lấy Note.id từ note_id (custom note_id hoặc UUID) - cùng logic với db_service.get_note_by_id
+        """
+        condition = Note.note_id == note_id
+        try:
+            condition = or_(condition, Note.id == uuid.UUID(note_id))
+        except ValueError:
+            pass
+        return select(Note.id).where(condition).limit(1).scalar_subquery()
+    
+    @staticmethod
+    def _statistics_columns(rating: Any, feedback_type: Any) -> List[Any]:
+        """
+        Các cột aggregate cho thống kê feedback (dùng FILTER để tính tất cả trong một lần scan)
+        """
+        return [
+            func.count(),
+            func.avg(rating),
+            *(func.count().filter(rating == r) for r in _RATINGS),
+            *(func.count().filter(feedback_type == t) for t in _FEEDBACK_TYPES),
+        ]
+    
+    @staticmethod
+    def _statistics_from_row(row: Sequence[Any]) -> Dict[str, Any]:
+        """
+        Dựng dict statistics từ kết quả của _statistics_columns
+        """
+        total, avg_rating, *counts = row
+        if not total:
+            return {
+                'total': 0,
+                'average_rating': 0,
+                'rating_distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0},
+                'positive_count': 0,
+                'negative_count': 0,
+                'neutral_count': 0
+            }
+        
+        rating_counts = counts[:len(_RATINGS)]
+        positive_count, negative_count, neutral_count = counts[len(_RATINGS):]
+        return {
+            'total': total,
+            'average_rating': round(float(avg_rating or 0), 2),
+            'rating_distribution': dict(zip(_RATINGS, rating_counts)),
+            'positive_count': positive_count,
+            'negative_count': negative_count,
+            'neutral_count': neutral_count
+        }
+    
+    @staticmethod
+    def get_feedbacks_with_statistics(
+        db: Session,
+        note_id: str,
+        limit: int = 50,
+        offset: int = 0
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Lấy một trang feedbacks của note (JSON array do Postgres dựng, mới nhất trước)
+        kèm thống kê feedback của note - tất cả trong một query (CTE trên cùng rowset)
+        
+        Args:
+            note_id: Note ID (custom note_id hoặc UUID)
+            limit: Số lượng feedbacks tối đa
+            offset: Offset cho pagination
+            
+        Returns:
+            (JSON array string của feedbacks, dict statistics)
+        """
+        from app.services.db_service import db_service
+        fb = select(*FEEDBACK_JSON_COLUMNS).where(
+            Feedback.note_id == FeedbackService._note_pk_subquery(note_id)
+        ).cte('fb')
+        page = select(fb).order_by(fb.c.created_at.desc()).limit(limit).offset(offset).subquery('page')
+        feedbacks_json = select(
+            db_service.json_array(page, FEEDBACK_JSON_COLUMNS, page.c.created_at)
+        ).scalar_subquery()
+        
+        row = db.execute(
+            select(
+                feedbacks_json,
+                *FeedbackService._statistics_columns(fb.c.rating, fb.c.feedback_type)
+            ).select_from(fb)
+        ).one()
+        return row[0], FeedbackService._statistics_from_row(row[1:])
     
     @staticmethod
     def get_user_feedbacks(
@@ -111,13 +241,17 @@ class FeedbackService:
         user_id: str,
         limit: int = 50,
         offset: int = 0
-    ) -> List[Feedback]:
+    ) -> Tuple[str, int]:
         """
         Lấy danh sách feedbacks của user
+        
+        Returns:
+            (JSON array string của feedbacks, tổng số feedbacks của user)
         """
-        return db.query(Feedback).filter(
-            Feedback.user_id == uuid.UUID(user_id)
-        ).order_by(desc(Feedback.created_at)).limit(limit).offset(offset).all()
+        from app.services.db_service import db_service
+        return db_service.json_page(
+            db, FEEDBACK_JSON_COLUMNS, [Feedback.user_id == uuid.UUID(user_id)], Feedback.created_at, limit, offset
+        )
     
     @staticmethod
     def get_positive_feedbacks(
@@ -160,50 +294,15 @@ class FeedbackService:
         Returns:
             Dict với statistics
         """
-        query = db.query(Feedback)
+        query = select(*FeedbackService._statistics_columns(Feedback.rating, Feedback.feedback_type))
         
         if note_id:
             from app.services.db_service import db_service
             note = db_service.get_note_by_id(db, note_id)
             if note:
-                query = query.filter(Feedback.note_id == note.id)
-        
-        total = query.count()
+                query = query.where(Feedback.note_id == note.id)
         
-        if total == 0:
-            return {
-                'total': 0,
-                'average_rating': 0,
-                'rating_distribution': {1: 0, 2: 0, 3: 0, 4: 0, 5: 0},
-                'positive_count': 0,
-                'negative_count': 0,
-                'neutral_count': 0
-            }
-        
-        # Average rating
-        avg_rating = db.query(func.avg(Feedback.rating)).filter(
-            query.whereclause if hasattr(query, 'whereclause') else True
-        ).scalar() or 0
-        
-        # Rating distribution
-        rating_dist = {}
-        for rating in range(1, 6):
-            count = query.filter(Feedback.rating == rating).count()
-            rating_dist[rating] = count
-        
-        # Feedback type counts
-        positive_count = query.filter(Feedback.feedback_type == 'positive').count()
-        negative_count = query.filter(Feedback.feedback_type == 'negative').count()
-        neutral_count = query.filter(Feedback.feedback_type == 'neutral').count()
-        
-        return {
-            'total': total,
-            'average_rating': round(float(avg_rating), 2),
-            'rating_distribution': rating_dist,
-            'positive_count': positive_count,
-            'negative_count': negative_count,
-            'neutral_count': neutral_count
-        }
+        return FeedbackService._statistics_from_row(db.execute(query).one())
     
     @staticmethod
     def get_improvement_insights(db: Session, limit: int = 5) -> Dict[str, Any]:
@@ -223,11 +322,11 @@ class FeedbackService:
             positive_feedbacks = FeedbackService.get_positive_feedbacks(db, limit=limit)
             positive_examples = []
             for fb in positive_feedbacks:
-                note = db.query(Note).filter(Note.id == fb.note_id).first()
+                note = db.query(Note.summary, _RAW_TEXT_PREVIEW).filter(Note.id == fb.note_id).first()
                 if note and note.summary:
                     positive_examples.append({
                         'summary': note.summary,
-                        'raw_text': note.raw_text[:200] if note.raw_text else None,  # First 200 chars
+                        'raw_text': note.raw_text_preview,  # First 200 chars
                         'rating': fb.rating,
                         'comment': fb.comment,
                         'liked_aspects': fb.liked_aspects
@@ -237,11 +336,11 @@ class FeedbackService:
             negative_feedbacks = FeedbackService.get_negative_feedbacks(db, limit=limit)
             negative_examples = []
             for fb in negative_feedbacks:
-                note = db.query(Note).filter(Note.id == fb.note_id).first()
+                note = db.query(Note.summary, _RAW_TEXT_PREVIEW).filter(Note.id == fb.note_id).first()
                 if note and note.summary:
                     negative_examples.append({
                         'summary': note.summary,
-                        'raw_text': note.raw_text[:200] if note.raw_text else None,
+                        'raw_text': note.raw_text_preview,
                         'rating': fb.rating,
                         'comment': fb.comment,
                         'disliked_aspects': fb.disliked_aspects,
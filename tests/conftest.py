@@ -0,0 +1,5 @@
+import os
+
+# Các agent tạo LLM client ngay khi import; test không gọi API thật nên chỉ cần key giả
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
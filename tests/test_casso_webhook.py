@@ -0,0 +1,194 @@
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.api.routes.payment as payment_routes
+from app.database.database import get_db
+from app.database.models import AccountType, Payment, User
+
+
+class FakeQuery:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def filter(self, *args):
+        return self
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeSession:
+    def __init__(self, payments, users):
+        self._rows = {Payment: payments, User: users}
+        self.queries = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def query(self, model):
+        self.queries.append(model)
+        return FakeQuery(self._rows[model])
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def _make_user():
+    return User(id=uuid.uuid4(), username=f"user-{uuid.uuid4().hex[:6]}", email="u@example.com", hashed_password="x")
+
+
+def _pending_payment(user_id, amount=99000):
+    return Payment(
+        id=uuid.uuid4(),
+        user_id=user_id,
+        amount=amount,
+        currency="VND",
+        payment_method="casso",
+        transaction_id=str(uuid.uuid4()),
+        status="pending",
+        subscription_months=1,
+        payment_data={"plan_id": "pro_1_month"},
+    )
+
+
+def _transaction(order_id, amount=99000, txn_id=1):
+    return {"id": txn_id, "amount": amount, "description": f"NOTALLYX {order_id}"}
+
+
+@pytest.fixture
+def make_client():
+    def _make(db):
+        api = FastAPI()
+        api.include_router(payment_routes.router)
+        api.dependency_overrides[get_db] = lambda: db
+        return TestClient(api)
+
+    return _make
+
+
+def test_webhook_batch_applies_all_transactions_with_one_commit(make_client):
+    users = [_make_user() for _ in range(2)]
+    payments = [_pending_payment(user.id) for user in users]
+    db = FakeSession(payments, users)
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={"data": [_transaction(p.id, txn_id=i) for i, p in enumerate(payments)]},
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [r["status"] for r in body["results"]] == ["success", "success"]
+    # Payments và users của cả batch: hai query IN, một commit
+    assert db.queries == [Payment, User]
+    assert db.commits == 1
+    assert all(p.status == "completed" for p in payments)
+    assert all(p.payment_data["casso_transaction"]["order_id"] == str(p.id).upper() for p in payments)
+    assert all(p.payment_data["plan_id"] == "pro_1_month" for p in payments)
+    assert all(u.account_type == AccountType.PRO and u.daily_note_limit == -1 for u in users)
+    assert all(p.subscription_end == u.subscription_end for p, u in zip(payments, users))
+
+
+def test_webhook_partial_batch_still_succeeds(make_client):
+    user = _make_user()
+    payment = _pending_payment(user.id)
+    db = FakeSession([payment], [user])
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={"data": [_transaction(payment.id), {"description": "chuyển khoản khác", "amount": 1}]},
+    )
+
+    assert response.status_code == 200
+    assert [r["status"] for r in response.json()["results"]] == ["success", "ignored"]
+    assert db.commits == 1
+
+
+def test_webhook_all_unmatched_is_acknowledged_without_commit(make_client):
+    db = FakeSession([], [])
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={
+            "data": [
+                {"description": "không có mã đơn", "amount": 99000},
+                {"description": "NOTALLYX not-a-uuid", "amount": 99000},
+                {"description": f"NOTALLYX {uuid.uuid4()}", "amount": "abc"},
+                _transaction(uuid.uuid4()),
+            ]
+        },
+    )
+
+    # Gửi lại cũng không khớp được -> 2xx để CASSO không retry
+    assert response.status_code == 200
+    statuses = [r["status"] for r in response.json()["results"]]
+    assert statuses == ["ignored", "ignored", "invalid", "ignored"]
+    assert db.commits == 0
+
+
+def test_webhook_unknown_payment_is_ignored(make_client):
+    db = FakeSession([], [])
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={"data": _transaction(uuid.uuid4())},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ignored", "message": "Payment not found"}
+    assert db.commits == 0
+
+
+def test_webhook_amount_mismatch_is_acknowledged(make_client):
+    user = _make_user()
+    payment = _pending_payment(user.id)
+    db = FakeSession([payment], [user])
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={"data": _transaction(payment.id, amount=1000)},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "amount_mismatch"
+    assert payment.status == "pending"
+    assert db.commits == 0
+
+
+def test_webhook_db_error_returns_503_so_casso_retries(make_client):
+    class FailingSession(FakeSession):
+        def commit(self):
+            raise RuntimeError("connection lost")
+
+    user = _make_user()
+    payment = _pending_payment(user.id)
+    db = FailingSession([payment], [user])
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={"data": _transaction(payment.id)},
+    )
+
+    assert response.status_code == 503
+    assert db.rollbacks == 1
+
+
+def test_webhook_already_processed_is_acknowledged(make_client):
+    user = _make_user()
+    payment = _pending_payment(user.id)
+    payment.status = "completed"
+    db = FakeSession([payment], [user])
+
+    response = make_client(db).post(
+        "/payment/casso/webhook",
+        json={"data": _transaction(payment.id)},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "already_processed"
+    assert db.commits == 0
@@ -0,0 +1,70 @@
+import json
+import random
+
+import pytest
+
+from app.api.v1.router import _stable_checked_vocab_items
+
+
+def legacy_stable_checked_vocab_items(checked_vocab_items):
+    # Bản dùng json.loads/json.dumps trước khi chuyển sang orjson - content_hash đã lưu dựa trên output này
+    if not checked_vocab_items:
+        return ""
+    s = checked_vocab_items.strip()
+    if not s:
+        return ""
+    try:
+        parsed = json.loads(s)
+        if isinstance(parsed, list):
+            dedup = {}
+            for x in parsed:
+                if x is None:
+                    continue
+                item = str(x).strip()
+                if not item:
+                    continue
+                key = item.lower()
+                if key not in dedup:
+                    dedup[key] = item
+            normalized = list(dedup.values())
+            normalized.sort(key=lambda v: v.lower())
+            return json.dumps(normalized, ensure_ascii=False)
+    except Exception:
+        pass
+    return s
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        None,
+        "",
+        "   ",
+        "[]",
+        '["Apple", "apple", " banana ", null, "", "Cherry"]',
+        '["Xin chào", "xin CHÀO", "tiếng Việt"]',
+        '["a\\u0000b", "tab\\t", "\\"quoted\\"", "\\u2028", "\\u007f"]',
+        '[1, 2.5, true, false, {"a": 1}, [1, 2]]',
+        "[NaN, Infinity, -Infinity]",
+        "[12345678901234567890123]",
+        "[1e400]",
+        '["\\ud800"]',
+        '{"not": "a list"}',
+        "không phải json",
+        '  ["padded"]  ',
+    ],
+)
+def test_stable_checked_vocab_items_matches_legacy(raw):
+    assert _stable_checked_vocab_items(raw) == legacy_stable_checked_vocab_items(raw)
+
+
+def test_stable_checked_vocab_items_matches_legacy_fuzz():
+    rng = random.Random(42)
+    alphabet = [chr(i) for i in range(0x80)] + ["é", "Ä", "ß", "İ", "ǅ", "ﬃ", "😀", " "]
+    for _ in range(3000):
+        items = [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 4)))
+            for _ in range(rng.randint(0, 6))
+        ]
+        raw = json.dumps(items, ensure_ascii=rng.random() < 0.5)
+        assert _stable_checked_vocab_items(raw) == legacy_stable_checked_vocab_items(raw), raw
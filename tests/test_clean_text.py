@@ -0,0 +1,83 @@
+import random
+import re
+import unicodedata
+
+import pytest
+
+from app.core.preprocessor import COMMON_SPELLING_ERRORS, clean_text
+
+
+# Bản clean_text trước khi gộp các regex thành một pass - kết quả mới phải giống hệt
+_BULLET_PATTERN = re.compile(r'^\s*[-•●·]\s+', re.MULTILINE)
+_MULTI_SPACE_PATTERN = re.compile(r'\s+')
+_EXTRA_PUNCT_PATTERN = re.compile(r'([!?.,;:]){2,}')
+_SPACE_BEFORE_PUNCT = re.compile(r'\s+([!?.,;:])')
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+
+def _legacy_spell_correct(text):
+    corrected = []
+    for token in re.split(r'(\W+)', text):
+        key = token.lower()
+        if key in COMMON_SPELLING_ERRORS:
+            replacement = COMMON_SPELLING_ERRORS[key]
+            if token.istitle():
+                replacement = replacement.capitalize()
+            elif token.isupper():
+                replacement = replacement.upper()
+            corrected.append(replacement)
+        else:
+            corrected.append(token)
+    return ''.join(corrected)
+
+
+def legacy_clean_text(text):
+    if not text:
+        return ''
+    normalized = unicodedata.normalize('NFC', text)
+    normalized = normalized.replace('\r', ' ').strip()
+    normalized = _BULLET_PATTERN.sub(lambda match: "\n- ", normalized)
+    normalized = _MULTI_SPACE_PATTERN.sub(' ', normalized)
+    normalized = _EXTRA_PUNCT_PATTERN.sub(lambda m: m.group(1), normalized)
+    normalized = _SPACE_BEFORE_PUNCT.sub(r'\1', normalized)
+    normalized = _legacy_spell_correct(normalized)
+    sentences = [seg.strip() for seg in _SENTENCE_BOUNDARY.split(normalized) if seg.strip()]
+    return ' '.join(sentences).strip()
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "   ",
+        "Xin chào   thế giới !!",
+        "Hôm nay ko đi học , mik ở nhà .",
+        "KO biết.  Ko sao!?  kO được",
+        "K ơi, K đi đâu?",
+        "a . . b ,, . c ;:;",
+        "Dòng 1\r\nDòng 2\n\n\tDòng 3",
+        "- ý một\n• ý hai\n   ● ý ba\n· ý bốn",
+        "BT thì Bt mà bt",
+        "1k đồng, k_ok, dc. đc hok.",
+        "teh adress to recieve",
+        "Dấu tổ hợp: Tie\u0302\u0301ng Vie\u0323\u0302t",
+        "a  b c",
+        "Hết câu.Sang câu!Rồi?",
+        "... bắt đầu bằng dấu câu",
+    ],
+)
+def test_clean_text_matches_legacy_pipeline(text):
+    assert clean_text(text) == legacy_clean_text(text)
+
+
+def test_clean_text_matches_legacy_pipeline_fuzz():
+    rng = random.Random(1234)
+    words = list(COMMON_SPELLING_ERRORS) + [
+        "không", "Được", "note", "AI", "k1", "Ko", "KG", "x", "ý", "ĐC", "Mik",
+    ]
+    separators = [" ", "  ", "\n", "\t", " .", "..", "!?", " , ", ";", ":", "\r\n", "- ", "\n• ", " "]
+    for _ in range(2000):
+        text = "".join(
+            rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(1, 12))
+        )
+        assert clean_text(text) == legacy_clean_text(text), text
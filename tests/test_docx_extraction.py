@@ -0,0 +1,47 @@
+from docx import Document
+from docx.oxml import parse_xml
+
+from app.core.preprocessor import process_docx_file
+
+
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_MC = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+_WPS = "http://schemas.microsoft.com/office/word/2010/wordprocessingShape"
+_V = "urn:schemas-microsoft-com:vml"
+
+# Paragraph chứa text box như Word lưu: cùng nội dung trong mc:Choice (DrawingML) và mc:Fallback (VML)
+_TEXT_BOX_PARAGRAPH = f"""
+<w:p xmlns:w="{_W}" xmlns:mc="{_MC}" xmlns:wps="{_WPS}" xmlns:v="{_V}">
+  <w:r><w:t>Trước text box</w:t></w:r>
+  <w:r>
+    <mc:AlternateContent>
+      <mc:Choice Requires="wps">
+        <w:drawing><wps:txbx><w:txbxContent>
+          <w:p><w:r><w:t>Nội dung text box</w:t></w:r></w:p>
+        </w:txbxContent></wps:txbx></w:drawing>
+      </mc:Choice>
+      <mc:Fallback>
+        <w:pict><v:shape><v:textbox><w:txbxContent>
+          <w:p><w:r><w:t>Nội dung text box</w:t></w:r></w:p>
+        </w:txbxContent></v:textbox></v:shape></w:pict>
+      </mc:Fallback>
+    </mc:AlternateContent>
+  </w:r>
+</w:p>
+"""
+
+
+def _docx_with_text_box(tmp_path):
+    doc = Document()
+    doc.add_paragraph("Mở đầu")._p.addnext(parse_xml(_TEXT_BOX_PARAGRAPH))
+    table = doc.add_table(rows=1, cols=1)
+    table.cell(0, 0).text = "Ô bảng"
+    path = tmp_path / "text_box.docx"
+    doc.save(path)
+    return str(path)
+
+
+def test_text_box_text_is_extracted_once(tmp_path):
+    text = process_docx_file(_docx_with_text_box(tmp_path))
+
+    assert text.split("\n") == ["Mở đầu", "Trước text box", "Nội dung text box", "Ô bảng"]
@@ -0,0 +1,143 @@
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.api.v1.router as router_module
+from app.database.database import get_db
+from app.services.cache_service import CacheService
+
+
+class FakeNoteStore:
+    """Một note trong 'DB'; đếm số lần load cả note để kiểm tra 304/cache không chạm tới nó"""
+
+    def __init__(self):
+        self.note = SimpleNamespace(
+            id=uuid.uuid4(),
+            note_id="note-1",
+            content_hash="abc123",
+            updated_at=datetime(2024, 1, 1, 12, 0, 0),
+            summary="Tóm tắt",
+            summaries={"one_sentence": "Một câu."},
+            review={"vocab_story": None},
+            questions=[],
+            mcqs={},
+            raw_text="raw",
+            processed_text="processed",
+        )
+        self.full_loads = 0
+
+    def get_version(self, db, note_id, user_id=None):
+        if note_id != self.note.note_id:
+            return None
+        return self.note.id, self.note.content_hash, self.note.updated_at
+
+    def get_note(self, db, note_id, user_id=None):
+        self.full_loads += 1
+        return self.note if note_id == self.note.note_id else None
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeNoteStore()
+    monkeypatch.setattr(router_module.db_service, "get_note_version_prefer_user", store.get_version)
+    monkeypatch.setattr(router_module.db_service, "get_note_prefer_user", store.get_note)
+    monkeypatch.setattr(router_module, "cache_service", CacheService())
+    return store
+
+
+@pytest.fixture
+def client():
+    api = FastAPI()
+    api.include_router(router_module.router)
+    api.dependency_overrides[get_db] = lambda: None
+    return TestClient(api)
+
+
+def test_get_note_returns_etag_and_304_round_trip(store, client):
+    first = client.get("/notes/note-1")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert etag.startswith('"abc123-')
+    assert first.json()["summary"] == "Tóm tắt"
+
+    second = client.get("/notes/note-1", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["etag"] == etag
+    # 304 chỉ cần query (id, content_hash, updated_at)
+    assert store.full_loads == 1
+
+
+def test_get_note_serves_cached_body_for_same_version(store, client):
+    first = client.get("/notes/note-1")
+    second = client.get("/notes/note-1")
+
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert store.full_loads == 1
+
+
+def test_get_note_etag_changes_when_note_is_updated(store, client):
+    etag = client.get("/notes/note-1").headers["etag"]
+
+    store.note.updated_at = datetime(2024, 1, 2, 8, 30, 0)
+    store.note.summary = "Tóm tắt mới"
+    response = client.get("/notes/note-1", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["summary"] == "Tóm tắt mới"
+    assert store.full_loads == 2
+
+
+def test_get_note_stale_if_none_match_gets_full_body(store, client):
+    response = client.get("/notes/note-1", headers={"If-None-Match": '"something-else"'})
+
+    assert response.status_code == 200
+    assert response.json()["processed_text"] == "processed"
+
+
+def test_get_note_missing_returns_404(store, client):
+    assert client.get("/notes/unknown").status_code == 404
+
+
+def test_body_cached_after_save_matches_db_hit_body(store, monkeypatch):
+    note = store.note
+    monkeypatch.setattr(router_module, "_get_cached_user", lambda db, username: (str(uuid.uuid4()), "free"))
+    monkeypatch.setattr(router_module.db_service, "get_note_fresh_version", lambda *args: (note.id, note.updated_at))
+    monkeypatch.setattr(router_module.db_service, "get_note_if_fresh", lambda *args: note)
+    from_db = router_module._try_serve_cached(None, "user", "note-1", "abc123")
+
+    # Cache mới, body được dựng ngay sau khi lưu -> lần đọc sau phải trả đúng body như đọc từ DB
+    monkeypatch.setattr(router_module, "cache_service", CacheService())
+    router_module._cache_note_body(note, router_module._build_cached_response(note), "abc123")
+    monkeypatch.setattr(router_module.db_service, "get_note_if_fresh", lambda *args: pytest.fail("should hit memory cache"))
+
+    assert router_module._try_serve_cached(None, "user", "note-1", "abc123") == from_db
+
+
+@pytest.mark.parametrize("header", ["W/{etag}", '"other", {etag}', "*"])
+def test_get_note_if_none_match_accepts_weak_and_list_validators(store, client, header):
+    etag = client.get("/notes/note-1").headers["etag"]
+
+    response = client.get("/notes/note-1", headers={"If-None-Match": header.format(etag=etag)})
+
+    assert response.status_code == 304
+
+
+def test_etag_includes_schema_version():
+    etag = router_module._note_etag("abc123", datetime(2024, 1, 1))
+    assert f"-v{router_module.AI_RESULT_SCHEMA_VERSION}-" in etag
+
+
+def test_respond_cached_ignores_if_none_match_on_post():
+    updated_at = datetime(2024, 1, 1)
+    response = router_module._respond_cached("abc123", updated_at, b"{}")
+
+    assert response.status_code == 200
+    assert response.body == b"{}"
+    assert response.headers["etag"] == router_module._note_etag("abc123", updated_at)
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.api.v1.auth_wrapper import increment_user_note_count
+from app.auth.rate_limiter import increment_note_count
+from app.database.models import AccountType, User
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def _register_pg_functions(dbapi_conn, _):
+        # server_default của models dùng timezone('utc', now()) của Postgres
+        dbapi_conn.create_function("now", 0, lambda: datetime.utcnow().isoformat(" "))
+        dbapi_conn.create_function("timezone", 2, lambda _tz, ts: ts)
+
+    User.__table__.create(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _make_user(db, notes_today, limit=3, last_reset=None, account_type=AccountType.FREE):
+    user = User(
+        username="alice",
+        email="alice@example.com",
+        hashed_password="x",
+        account_type=account_type,
+        daily_note_limit=limit,
+        notes_created_today=notes_today,
+        last_reset_date=last_reset or datetime.utcnow(),
+    )
+    db.add(user)
+    db.commit()
+    return user
+
+
+def _stored_count(db, user):
+    return db.query(User.notes_created_today).filter(User.id == user.id).scalar()
+
+
+def test_increment_below_limit_updates_row_and_session_user(db):
+    user = _make_user(db, notes_today=2)
+
+    assert increment_note_count(db, user) is True
+    assert _stored_count(db, user) == 3
+    assert user.notes_created_today == 3
+    assert user not in db.dirty
+
+
+def test_increment_at_limit_is_rejected_and_counter_unchanged(db):
+    user = _make_user(db, notes_today=3)
+
+    assert increment_note_count(db, user) is False
+    assert _stored_count(db, user) == 3
+    assert user.notes_created_today == 3
+
+
+def test_increment_resets_counter_on_new_day(db):
+    user = _make_user(db, notes_today=3, last_reset=datetime.utcnow() - timedelta(days=1))
+
+    assert increment_note_count(db, user) is True
+    assert _stored_count(db, user) == 1
+    assert user.notes_created_today == 1
+    assert user.last_reset_date.date() == datetime.utcnow().date()
+
+
+def test_increment_unlimited_account_is_never_rejected(db):
+    user = _make_user(db, notes_today=100, limit=-1, account_type=AccountType.PRO)
+
+    assert increment_note_count(db, user) is True
+    assert _stored_count(db, user) == 101
+
+
+@pytest.mark.asyncio
+async def test_increment_user_note_count_raises_429_at_limit(db):
+    user = _make_user(db, notes_today=3)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await increment_user_note_count(user, db)
+
+    assert exc_info.value.status_code == 429
+    assert _stored_count(db, user) == 3
+
+
+@pytest.mark.asyncio
+async def test_increment_user_note_count_leaves_commit_to_caller(db):
+    user = _make_user(db, notes_today=1)
+
+    await increment_user_note_count(user, db)
+    assert _stored_count(db, user) == 2
+    db.rollback()
+
+    # Không tự commit: rollback của caller (vd lưu note lỗi) bỏ luôn lượt tăng
+    assert _stored_count(db, user) == 1
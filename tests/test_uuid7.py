@@ -0,0 +1,47 @@
+import time
+import uuid
+
+import pytest
+
+from app.database.models import Feedback, Note, Payment, _uuid7
+
+
+def test_uuid7_format():
+    value = _uuid7()
+
+    assert isinstance(value, uuid.UUID)
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+    # Round-trip qua string giống id trả ra API
+    assert uuid.UUID(str(value)) == value
+
+
+def test_uuid7_embeds_current_unix_ms():
+    before = time.time_ns() // 1_000_000
+    value = _uuid7()
+    after = time.time_ns() // 1_000_000
+
+    assert before <= value.int >> 80 <= after
+
+
+def test_uuid7_sorts_by_creation_time():
+    values = []
+    for _ in range(5):
+        values.append(_uuid7())
+        time.sleep(0.002)
+
+    assert values == sorted(values)
+    assert [str(v) for v in values] == sorted(str(v) for v in values)
+
+
+def test_uuid7_is_unique_within_same_millisecond():
+    values = {_uuid7() for _ in range(10_000)}
+
+    assert len(values) == 10_000
+
+
+@pytest.mark.parametrize("model", [Note, Feedback, Payment])
+def test_primary_keys_default_to_uuid7(model):
+    value = model.__table__.c.id.default.arg(None)
+
+    assert value.version == 7